@@ -19,6 +19,12 @@ class CoinBackend(abc.ABC):
     The accounting amounts are in the integer amounts defined  by the datbase models, e.g. satoshis for Bitcoin. If the backend supplies amounts in different unit, they most be converted  forth and back by the backend. For the example, see :py:class:`cryptoassets.core.backend.blockio`.
     """
 
+    #: How many addresses we pass to :py:meth:`get_balances` in one call. Set by ``Configurator.setup_backend`` from ``balance_batch_size`` option.
+    balance_batch_size = 500
+
+    #: How many requests we run against the backend at once from one helper service job. Set by ``Configurator.setup_backend`` from ``max_inflight`` option.
+    max_inflight = 4
+
     def __init__(self):
         #: If ``track_incoming_confirmations`` is set to true, this is how many confirmations we track for each incoming transactions until we consider it "closed". Please note that this is API will most likely be changed in the future and this variable move to somewhere else.
         #: The variable is set by ``Configurator.setup_backend``.
@@ -78,6 +84,17 @@ class CoinBackend(abc.ABC):
         :return: Instance of :py:class:`cryptoassets.core.backend.base.ListTransactionsIterator`.
         """
 
+    def get_transactions(self, txids):
+        """Get details of several transactions.
+
+        Backends which can look up many transactions in one request override this. By default :py:meth:`get_transaction` is called for each txid.
+
+        :param txids: List of network transaction hashes
+
+        :return: Dict of txid -> transaction details in *bitcoind* format. Transactions the backend could not look up may be left out.
+        """
+        return {txid: self.get_transaction(txid) for txid in txids}
+
     def create_transaction_updater(self, conflict_resolver, event_handler_registry):
         """Create transaction updater to handle database writes with this backend.
 
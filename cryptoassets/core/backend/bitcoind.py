@@ -66,10 +66,23 @@ from ..event.registry import EventHandlerRegistry
 logger = logging.getLogger(__name__)
 
 
+#: JSON-RPC error code bitcoind gives when ``gettransaction`` is called with an invalid or non-wallet txid
+RPC_INVALID_ADDRESS_OR_KEY = -5
+
+
 class BitcoindJSONError(Exception):
     pass
 
 
+def is_invalid_transaction_error(e):
+    """Tell if bitcoind refused to look up a transaction because the txid is invalid or not in our wallet.
+
+    :param e: Exception raised by :py:meth:`Bitcoind.api_call`
+    """
+    cause = e.__cause__ if isinstance(e, BitcoindJSONError) else e
+    return isinstance(cause, JSONRPCException) and cause.error.get("code") == RPC_INVALID_ADDRESS_OR_KEY
+
+
 class Bitcoind(base.CoinBackend):
     """Backend for the original bitcoind or its derivates over stock JSON-RPC API.
 
@@ -250,6 +263,30 @@ class Bitcoind(base.CoinBackend):
         """ """
         return self.api_call("gettransaction", txid)
 
+    def get_transactions(self, txids):
+        """Look up several transactions with one JSON-RPC batch request.
+
+        Batch responses are not guaranteed to come in the request order, so they are matched to txids by the ``txid`` field of the transaction. If the batch fails, e.g. because one txid is not a wallet transaction, the transactions are looked up one by one and the invalid txids are left out.
+
+        Falls back to one request per transaction if the installed python-bitcoinrpc does not support batches.
+        """
+        if hasattr(AuthServiceProxy, "batch_"):
+            try:
+                results = self.api_call("batch_", [["gettransaction", txid] for txid in txids])
+                return {txdata["txid"]: txdata for txdata in results}
+            except (BitcoindJSONError, JSONRPCException) as e:
+                logger.warning("Batch lookup of %d transactions failed, looking them up one by one: %s", len(txids), e)
+
+        transactions = {}
+        for txid in txids:
+            try:
+                transactions[txid] = self.get_transaction(txid)
+            except (BitcoindJSONError, JSONRPCException) as e:
+                if not is_invalid_transaction_error(e):
+                    raise
+                logger.warning("Could not look up transaction %s: %s", txid, e)
+        return transactions
+
     def send(self, recipients, label):
         """ Broadcast outgoing transaction.
 
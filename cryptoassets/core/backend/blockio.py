@@ -43,6 +43,7 @@ import datetime
 import threading
 
 import requests
+from requests.adapters import HTTPAdapter
 from slugify import slugify
 
 from block_io import BlockIo as _BlockIo
@@ -94,6 +95,10 @@ class BlockIo(base.CoinBackend):
 
         self.walletnotify_config = walletnotify
 
+        # Keep-alive connections to chain.so, shared by the confirmation update and notification threads
+        self.http_session = requests.Session()
+        self.http_session.mount("https://", HTTPAdapter(pool_maxsize=8, max_retries=2))
+
     def require_tracking_incoming_confirmations(self):
         return True
 
@@ -167,7 +172,7 @@ class BlockIo(base.CoinBackend):
 
     def get_transaction(self, txid):
         """ """
-        resp = requests.get("https://chain.so/api/v2/get_tx/{}/{}".format(self.network, txid))
+        resp = self.http_session.get("https://chain.so/api/v2/get_tx/{}/{}".format(self.network, txid))
         data = resp.json()
         data = _transform_txdata_to_bitcoind_format(data)
         return data
@@ -0,0 +1,130 @@
+"""Hand wallet notifications over to worker threads.
+
+Wallet notify handlers read transaction ids in one thread. Looking up the transaction from the backend and writing it to the database is slow, so the reading thread passes the transaction ids to worker threads through a bounded queue.
+"""
+
+import logging
+import queue
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class WalletNotifyQueue:
+    """Mixin for wallet notify handlers passing transaction ids to worker threads.
+
+    A transaction id which is already waiting in the queue is not queued again. A transaction id notified again while a worker is handling it is handled once more by the same worker, so that two workers never update the same transaction at once.
+
+    The class using this must set ``running`` and implement ``handle_tx_update(txid)``.
+    """
+
+    def setup_queue(self, workers, queue_size):
+        """
+        :param workers: Number of threads handling the transaction updates
+
+        :param queue_size: Maximum number of transaction ids waiting for a worker
+        """
+        self.workers = workers
+        self.queue = queue.Queue(queue_size)
+
+        # txids in the queue or being handled by a worker
+        self.queued = set()
+        # txids notified again while being handled
+        self.renotified = set()
+        self.queued_lock = threading.Lock()
+
+    def queue_tx_update(self, txid):
+        """Pass the txid to a worker, unless it is already waiting for one or being handled.
+
+        Blocks while the queue is full, until there is room or the handler is stopped.
+        """
+        with self.queued_lock:
+            if txid in self.queued:
+                # The worker handling it will run it again
+                self.renotified.add(txid)
+                return
+            self.queued.add(txid)
+
+        while self.running:
+            try:
+                # Wake up every second to check if we have been stopped
+                self.queue.put(txid, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+        # Stopped, the confirmation poll and receive scan will pick up the transaction
+        with self.queued_lock:
+            self.queued.discard(txid)
+
+    def discard_queued(self):
+        """Drop the transaction ids still waiting for a worker.
+
+        Called on shutdown, so that we do not wait for backend calls of every queued transaction. The confirmation poll and receive scan will pick them up.
+
+        :return: Number of dropped transaction ids
+        """
+        count = 0
+        while True:
+            try:
+                txid = self.queue.get_nowait()
+            except queue.Empty:
+                return count
+
+            with self.queued_lock:
+                self.queued.discard(txid)
+            count += 1
+
+    def run_worker(self):
+        """Handle queued transaction updates until we get ``None``."""
+        while True:
+            txid = self.queue.get()
+            if txid is None:
+                break
+
+            while True:
+                with self.queued_lock:
+                    # Notifies arriving from now on need another update
+                    self.renotified.discard(txid)
+
+                try:
+                    self.handle_tx_update(txid)
+                except Exception as e:
+                    logger.error("Could not handle walletnotify for transaction %s", txid)
+                    logger.exception(e)
+
+                with self.queued_lock:
+                    if txid not in self.renotified:
+                        self.queued.discard(txid)
+                        break
+
+    def start_workers(self, name):
+        """Start the worker threads.
+
+        :param name: Prefix for the worker thread names
+
+        :return: List of started threads
+        """
+        workers = []
+        for i in range(self.workers):
+            worker = threading.Thread(target=self.run_worker, name="{}-worker-{}".format(name, i))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        return workers
+
+    def stop_workers(self, workers):
+        """Drop the queued transaction ids and wait until the workers have finished the ones they are handling.
+
+        :param workers: Threads returned by :py:meth:`start_workers`
+        """
+        discarded = self.discard_queued()
+        if discarded:
+            logger.info("Dropped %d queued walletnotify transactions on shutdown", discarded)
+
+        for worker in workers:
+            self.queue.put(None)
+
+        for worker in workers:
+            worker.join()
@@ -34,80 +34,76 @@ Options
 :param fname: Filename where the pipe is opened. Please note that any existing filename which same name is removed.
 
 :param mode: Unix file mode for the created pipe.
+
+:param workers: How many threads update the transactions read from the pipe. Default 4.
+
+:param queue_size: How many transaction ids can wait for a worker before we stop reading the pipe. Default 10000.
 """
 
 import os
 import logging
-import fcntl
-import time
+import selectors
 import threading
 
 from .base import IncomingTransactionRunnable
+from .notifyqueue import WalletNotifyQueue
 
 
 logger = logging.getLogger(__name__)
 
 
-# Courtesy of http://code.activestate.com/recipes/578900-non-blocking-readlines/
-def nonblocking_readlines(fd):
-    """Generator which yields lines from F (a file object, used only for
-       its fileno()) without blocking.  If there is no data, you get an
-       endless stream of empty strings until there is data again (caller
-       is expected to sleep for a while).
-       Newlines are normalized to the Unix standard.
-    """
+def nonblocking_readlines(fd, buf):
+    """Read everything currently available from a non-blocking file descriptor and return the complete lines.
+
+    Both ``\\n`` and ``\\r\\n`` line endings are accepted. An unfinished last line is left in ``buf`` until the rest of it arrives.
+
+    :param fd: File descriptor opened with ``O_NONBLOCK``
 
-    #fd = f.fileno()
-    fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-    fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-    enc = "utf-8"
+    :param buf: ``bytearray`` holding data left over from the previous call
 
-    buf = bytearray()
+    :return: List of decoded lines without line endings
+    """
     while True:
         try:
             block = os.read(fd, 8192)
         except BlockingIOError:
-            yield ""
-            continue
+            break
 
         if not block:
-            if buf:
-                yield buf.decode(enc)
-                buf.clear()
             break
 
         buf.extend(block)
 
-        while True:
-            r = buf.find(b'\r')
-            n = buf.find(b'\n')
-            if r == -1 and n == -1: break
+    end = max(buf.rfind(b"\n"), buf.rfind(b"\r"))
+    if end < 0:
+        return []
 
-            if r == -1 or r > n:
-                yield buf[:(n+1)].decode(enc)
-                buf = buf[(n+1):]
-            elif n == -1 or n > r:
-                yield buf[:r].decode(enc) + '\n'
-                if n == r+1:
-                    buf = buf[(r+2):]
-                else:
-                    buf = buf[(r+1):]
+    data = bytes(buf[:end + 1])
+    del buf[:end + 1]
 
+    # Garbage written to the pipe must not take down the reader thread
+    return data.decode("utf-8", errors="replace").splitlines()
 
-class PipedWalletNotifyHandlerBase:
+
+class PipedWalletNotifyHandlerBase(WalletNotifyQueue):
     """Handle walletnofify notificatians from bitcoind through named UNIX pipe.
 
     Creates a named unix pipe, e.g. ``/tmp/cryptoassets-btc-walletnotify``. Whenever the bitcoind, or any backend, sees a new tranasction they can write / echo the transaction id to this pipe and the cryptoassets helper service will update the transaction status to the database.
 
+    The pipe is read in one thread and the transaction ids are handed over to worker threads through a queue, see :py:class:`cryptoassets.core.backend.notifyqueue.WalletNotifyQueue`, so that slow database updates do not keep bitcoind waiting on the pipe.
     """
 
-    def __init__(self, transaction_updater, fname, mode=None):
+    def __init__(self, transaction_updater, fname, mode=None, workers=4, queue_size=10000):
         """
         :param transaction_updater: Instance of :py:class:`cryptoassets.core.backend.bitcoind.TransactionUpdater` or None
 
         :param name: Full path to the UNIX named pipe
 
         :param mode: Octal UNIX file mode for the named pipe
+
+        :param workers: Number of threads handling the transaction updates
+
+        :param queue_size: Maximum number of transaction ids waiting for a worker
         """
         self.transaction_updater = transaction_updater
         self.running = True
@@ -115,6 +111,7 @@ class PipedWalletNotifyHandlerBase:
         self.ready = False
         mode = mode if mode else 0o703
         self.mode = mode
+        self.setup_queue(workers, queue_size)
 
     def handle_tx_update(self, txid):
         """Handle each transaction notify as its own db commit."""
@@ -125,7 +122,8 @@ class PipedWalletNotifyHandlerBase:
 
     def run(self):
 
-        reader = None
+        fd = writer = None
+        workers = []
 
         logger.info("Starting PipedWalletNotifyHandler")
         try:
@@ -139,14 +137,29 @@ class PipedWalletNotifyHandlerBase:
 
             fd = os.open(self.fname, os.O_RDONLY | os.O_NONBLOCK)
 
+            # Keep our own write end open. Otherwise the pipe is at EOF whenever bitcoind is not writing to it and select() would never block.
+            writer = os.open(self.fname, os.O_WRONLY | os.O_NONBLOCK)
+
+            selector = selectors.DefaultSelector()
+            selector.register(fd, selectors.EVENT_READ)
+
+            buf = bytearray()
+
+            workers = self.start_workers(self.fname)
+
             self.ready = True
 
             while self.running:
-                for line in nonblocking_readlines(fd):
-                    if line:
-                        txid = line.strip()
-                        self.handle_tx_update(txid)
-                time.sleep(0.1)
+                # Block until bitcoind writes something, wake up every second to check if we have been stopped
+                if not selector.select(timeout=1.0):
+                    continue
+
+                for line in nonblocking_readlines(fd, buf):
+                    txid = line.strip()
+                    if txid:
+                        self.queue_tx_update(txid)
+
+            selector.close()
 
         except Exception as e:
             logger.error("PipedWalletNotifyHandler crashed")
@@ -157,8 +170,14 @@ class PipedWalletNotifyHandlerBase:
             self.running = False
             self.ready = False
 
-            if reader:
-                os.close(reader)
+            # Let the workers finish the transactions they are handling and then exit
+            self.stop_workers(workers)
+
+            if writer is not None:
+                os.close(writer)
+
+            if fd is not None:
+                os.close(fd)
 
             os.unlink(self.fname)
 
@@ -170,6 +189,6 @@ class PipedWalletNotifyHandler(PipedWalletNotifyHandlerBase, threading.Thread, I
     """A thread which handles reading from walletnotify named pipe.
     """
 
-    def __init__(self, transaction_updater, fname, mode=None):
-        PipedWalletNotifyHandlerBase.__init__(self, transaction_updater, fname, mode)
+    def __init__(self, transaction_updater, fname, mode=None, workers=4, queue_size=10000):
+        PipedWalletNotifyHandlerBase.__init__(self, transaction_updater, fname, mode, workers, queue_size)
         threading.Thread.__init__(self)
@@ -1,8 +1,10 @@
 import datetime
 from collections import Counter
 import logging
+import threading
 from decimal import Decimal
 
+from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.session import Session
 
 from ..coin.registry import Coin
@@ -67,67 +69,64 @@ class TransactionUpdater:
         #: Diagnostics and bookkeeping statistics
         self.stats = Counter(network_transaction_updates=0, deposit_updates=0, broadcast_updates=0)
 
-    def _update_address_deposit(self, ntx, address, amount, confirmations):
-        """Handle an incoming transaction update to a single address.
+        # Walletnotify handlers may update transactions from several threads
+        self.stats_lock = threading.Lock()
+
+    def count_stat(self, name):
+        """Increment a statistics counter."""
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def _update_address_deposits(self, ntx, addresses, confirmations):
+        """Handle an incoming transaction update to several addresses.
 
         TODO: confirmations is relevant for mined coins only. Abstract it away here.
 
         We received an update regarding cryptocurrency transaction ``txid``. This may be a new transaction we have not seen before or an existing transaction. If the transaction confirmation count is exceeded, the transaction is also marked as credited and account who this address belongs balance is topped up.
 
-        ``_update_address_deposit`` will write the updated data to the database.
+        Addresses which are not our receiving addresses are skipped, as they can be just some third party outputs in a merged transaction. Our addresses are looked up in one query and deposited wallet by wallet with :py:meth:`cryptoassets.core.models.GenericWallet.deposit_many`.
+
+        ``_update_address_deposits`` will write the updated data to the database.
 
-        Note that a single cryptocurrency transaction may contain updates to several addresses or several received sections to a single address.
+        :param addresses: address -> amount mapping
 
-        :return: tuple (Transaction id, boolean credited) for the Transaction object created/updated related to external txid
+        :return: List of tuples (address, amount, Account id, Transaction id, boolean credited) for the Transaction objects created/updated related to external txid
         """
 
-        assert amount > 0
+        if not addresses:
+            return []
 
         session = Session.object_session(ntx)
 
         Address = self.coin.address_model
 
-        address_obj = session.query(Address).filter(Address.address == address).first()  # noqa
-
-        if address_obj:
-
-            assert address_obj.account, "Tried to _update_deposit() on non-deposit address. Depositing to: {}, address object is {}, label {}".format(address, address_obj, address_obj.label)
+        address_objs = session.query(Address).options(joinedload(Address.account)).filter(Address.address.in_(list(addresses.keys())), Address.account_id != None)  # noqa
 
+        # wallet id -> (wallet, [(address, amount), ...])
+        wallet_deposits = {}
+        for address_obj in address_objs:
             wallet = address_obj.account.wallet
+            wallet_deposits.setdefault(wallet.id, (wallet, []))[1].append((address_obj.address, addresses[address_obj.address]))
 
-            # Credit the account
-            # Pass confirmations in the extra transaction details
-            extra = dict(confirmations=confirmations)
+        # Pass confirmations in the extra transaction details
+        extra = dict(confirmations=confirmations)
 
-            account, transaction = wallet.deposit(ntx, address, amount, extra)
+        updated = []
+        for wallet, deposits in wallet_deposits.values():
+            # Credit the accounts
+            for (address, amount), (account, transaction, credited) in zip(deposits, wallet.deposit_many(ntx, deposits, extra)):
+                logger.info("Wallet notify account %d, address %s, amount %s, tx confirmations %d", account.id, address, amount, confirmations)
+                updated.append((address, amount, account, transaction, credited))
 
-            confirmations = transaction.confirmations
+        known = set(address for address, amount, account, transaction, credited in updated)
+        for address, amount in addresses.items():
+            if address not in known:
+                logger.info("Skipping transaction notify for unknown address %s, amount %s", address, amount)
 
-            logger.info("Wallet notify account %d, address %s, amount %s, tx confirmations %d", account.id, address, amount, confirmations)
+        # This will cause Transaction instances to get transaction.id
+        session.flush()
 
-            # This will cause Transaction instance to get transaction.id
-            session.flush()
-
-            return account.id, transaction.id, (transaction.credited_at is not None)
-
-        else:
-            logger.info("Skipping transaction notify for unknown address %s, amount %s", address, amount)
-            return None, None, None
-
-    def _is_known_deposit_address(self, session, address):
-        """Check if the address is belonging to us or in some third party system in merged transaction."""
-        Address = self.coin.address_model
-        address_obj = session.query(Address).filter(Address.address == address).first()  # noqa
-
-        # We have not seen this address before
-        if not address_obj:
-            return False
-
-        # This is not a deposit address generated by us
-        if not address_obj.is_deposit():
-            return False
-
-        return True
+        return [(address, amount, account.id, transaction.id, credited) for address, amount, account, transaction, credited in updated]
 
     def _get_broadcasted_transactions(self, ntx):
         """Get and verify the list of transaction broadcast concerned.
@@ -239,14 +238,21 @@ class TransactionUpdater:
                     return ntx.id, []
 
             confirmations = ntx.confirmations = txdata["confirmations"]
-            self.stats["network_transaction_updates"] += 1
+            self.count_stat("network_transaction_updates")
 
             logger.info("Updating network transaction %d, type %s, state %s, txid %s, confirmations to %s", ntx.id, ntx.transaction_type, ntx.state, ntx.txid, ntx.confirmations)
 
             if ntx.transaction_type == "deposit":
 
-                # Verify transaction data looks good compared what we have recorded earlier in the database
-                for tx in ntx.transactions:
+                # Verify transaction data looks good compared what we have recorded earlier in the database.
+                # A network transaction we just created has no transactions yet, so skip the query.
+                if created:
+                    known_transactions = []
+                else:
+                    Transaction = self.coin.transaction_model
+                    known_transactions = session.query(Transaction).options(joinedload(Transaction.address)).filter(Transaction.network_transaction_id == ntx.id)
+
+                for tx in known_transactions:
 
                     # XXX: verify_amount() fails with multisig transactions?
                     # https://chain.so/tx/BTC/40ad00b473f2cc9f33a84779eb22b8d233ef47b35a2afec77e2fff805af60084
@@ -256,31 +262,18 @@ class TransactionUpdater:
                 # Sum together received per address
                 addresses = Counter()  # address -> amount mapping
 
-                # XXX: room for optimization, do _is_known_deposit in single SQL batch
                 for detail in txdata["details"]:
                     if detail["category"] == "receive":
-
-                        # Do not care about the address unless it is our receiving address, otherwise it can be just some third party transfer in a merged transaction
-                        if not self._is_known_deposit_address(session, detail["address"]):
-                            logger.debug("Bailing out unknown address %s", detail["address"])
-                            continue
-
                         addresses[detail["address"]] += self.backend.to_internal_amount(detail["amount"])
 
-                for address, amount in addresses.items():
-
-                    # Handle updates to deposits
-                    account_id, transaction_id, credited = self._update_address_deposit(ntx, address, amount, confirmations)
+                # Handle updates to deposits
+                for address, amount, account_id, transaction_id, credited in self._update_address_deposits(ntx, addresses, confirmations):
 
                     logger.debug("Received deposit update for account %s, address %s, credited %s, confirmations %d", account_id, address, credited, confirmations)
 
-                    if not account_id:
-                        # This address was not in our system
-                        continue
-
-                    self.stats["deposit_updates"] += 1
+                    self.count_stat("deposit_updates")
 
-                    event = events.txupdate(coin_name=self.coin.name, network_transaction=ntx.id, transaction_type=ntx.transaction_type, txid=txid, transaction=transaction_id, account=account_id, address=address, amount=amount, confirmations=confirmations, credited=True)
+                    event = events.txupdate(coin_name=self.coin.name, network_transaction=ntx.id, transaction_type=ntx.transaction_type, txid=txid, transaction=transaction_id, account=account_id, address=address, amount=amount, confirmations=confirmations, credited=credited)
                     txupdate_events.append(event)
 
             else:
@@ -298,7 +291,7 @@ class TransactionUpdater:
                     event = events.txupdate(coin_name=self.coin.name, network_transaction=ntx.id, transaction_type=ntx.transaction_type, txid=txid, transaction=t.id, account=t.sending_account.id, address=t.address.address, amount=t.amount, confirmations=confirmations, credited=None)
                     txupdate_events.append(event)
 
-                    self.stats["broadcast_updates"] += 1
+                    self.count_stat("broadcast_updates")
 
             return ntx.id, txupdate_events
 
@@ -307,11 +300,11 @@ class TransactionUpdater:
         if txupdate_events:
 
             # Fire event handlers outside the db transaction
-            notifier_count = len(self.event_handler_registry.get_all()) if self.event_handler_registry else 0
-            logger.info("Posting txupdate notify for %d event_handler_registry, current transaction updater stats %s", notifier_count, self.stats)
+            if logger.isEnabledFor(logging.INFO):
+                notifier_count = len(self.event_handler_registry.get_all()) if self.event_handler_registry else 0
+                logger.info("Posting txupdate notify for %d event_handler_registry, current transaction updater stats %s", notifier_count, self.stats)
             if self.event_handler_registry:
-                for e in txupdate_events:
-                    self.event_handler_registry.trigger("txupdate", e)
+                self.event_handler_registry.trigger_many("txupdate", txupdate_events)
 
         return ntx_id, txupdate_events
 
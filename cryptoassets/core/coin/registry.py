@@ -5,6 +5,25 @@ Each cryptoasset provides its own Wallet SQLAlchemy model and backend instance w
 from zope.dottedname.resolve import resolve
 
 
+class _ModelRef:
+    """Resolve a model class from its dotted name on the first access.
+
+    The resolved class is stored in the instance ``__dict__`` under the same name. As this is a non-data descriptor, the later lookups are plain instance attribute hits and do not go through the descriptor again.
+    """
+
+    def __init__(self, name, dotted_name_attr, doc):
+        self.name = name
+        self.dotted_name_attr = dotted_name_attr
+        self.__doc__ = doc
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        val = resolve(getattr(instance, self.dotted_name_attr))
+        instance.__dict__[self.name] = val
+        return val
+
+
 class CoinModelDescription:
     """Describe one cryptocurrency data structures: what SQLAlchemy models and database tables it uses.
 
@@ -26,37 +45,16 @@ class CoinModelDescription:
         self.network_transaction_model_name = network_transaction_model_name
         self.address_validator = address_validator
 
-        # Direct model class reference. Available after Python modules are loaded and Cryptoassets App session initialized
-        self._Wallet = None
-        self._Address = None
-        self._Account = None
-        self._NetworkTransaction = None
-        self._Transaction = None
-
-    @property
-    def Wallet(self):
-        """Get wallet model class."""
-        return self._lazy_initialize_class_ref("_Wallet", self.wallet_model_name)
+    #: Direct model class references. Available after Python modules are loaded and Cryptoassets App session initialized
+    Wallet = _ModelRef("Wallet", "wallet_model_name", "Get wallet model class.")
 
-    @property
-    def Address(self):
-        """Get address model class."""
-        return self._lazy_initialize_class_ref("_Address", self.address_model_name)
+    Address = _ModelRef("Address", "address_model_name", "Get address model class.")
 
-    @property
-    def Account(self):
-        """Get account model class."""
-        return self._lazy_initialize_class_ref("_Account", self.account_model_name)
+    Account = _ModelRef("Account", "account_model_name", "Get account model class.")
 
-    @property
-    def NetworkTransaction(self):
-        """Get network transaction model class."""
-        return self._lazy_initialize_class_ref("_NetworkTransaction", self.network_transaction_model_name)
+    NetworkTransaction = _ModelRef("NetworkTransaction", "network_transaction_model_name", "Get network transaction model class.")
 
-    @property
-    def Transaction(self):
-        """Get transaction model class."""
-        return self._lazy_initialize_class_ref("_Transaction", self.transaction_model_name)
+    Transaction = _ModelRef("Transaction", "transaction_model_name", "Get transaction model class.")
 
     @property
     def wallet_table_name(self):
@@ -78,15 +76,6 @@ class CoinModelDescription:
     def network_transaction_table_name(self):
         return "{}_network_transaction".format(self.coin_name)
 
-    def _lazy_initialize_class_ref(self, name, dotted_name):
-        val = getattr(self, name, None)
-        if val:
-            return val
-        else:
-            val = resolve(dotted_name)
-            setattr(self, name, val)
-        return val
-
 
 class Coin:
     """Describe one cryptocurrency setup.
@@ -188,17 +177,21 @@ class CoinRegistry:
     def __init__(self):
         self.coins = {}
 
+        # Coins are registered at start up only, so all() can hand out the same tuple on every scheduler run
+        self._all = ()
+
     def register(self, name, coin):
         self.coins[name] = coin
         # Setup backref
         coin.name = name
+        self._all = tuple(self.coins.items())
 
     def all(self):
         """Get all registered coin models.
 
-        :return: List of tuples(coin name, Coin)
+        :return: Tuple of tuples(coin name, Coin)
         """
-        return self.coins.items()
+        return self._all
 
     def get(self, name):
         """Return coin setup data by its acronym name.
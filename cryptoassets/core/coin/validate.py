@@ -5,6 +5,7 @@ We provide some validators just to make sure we don't write bad outgoing transac
 
 import abc
 import logging
+from functools import lru_cache
 from hashlib import sha256
 
 logger = logging.getLogger(__name__)
@@ -39,15 +40,30 @@ class HashAddresValidator(AddressValidator):
 
     Does not do extensive checks like address type, etc. one could do with pycoin.
 
+    Results are remembered in a LRU cache, as withdrawals often go to the same addresses again and again.
+
     http://rosettacode.org/wiki/Bitcoin/address_validation
     """
 
     digits58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
 
+    #: Character -> base58 digit value lookup table
+    digit_values = {char: value for value, char in enumerate(digits58)}
+
+    def __init__(self, cache_size=4096):
+        """
+        :param cache_size: How many validated addresses to remember
+        """
+        self.cached_check_bc = lru_cache(maxsize=cache_size)(self.check_bc)
+
     def decode_base58(self, bc, length):
         n = 0
+        digit_values = self.digit_values
         for char in bc:
-            n = n * 58 + self.digits58.index(char)
+            try:
+                n = n * 58 + digit_values[char]
+            except KeyError:
+                raise ValueError("Not a base58 character: {}".format(char))
         return n.to_bytes(length, 'big')
 
     def check_bc(self, bc):
@@ -55,7 +71,7 @@ class HashAddresValidator(AddressValidator):
         return bcbytes[-4:] == sha256(sha256(bcbytes[:-4]).digest()).digest()[:4]
 
     def validate_address(self, address, testnet):
-        return self.check_bc(address)
+        return self.cached_check_bc(address)
 
 
 class NetworkCodeAddressValidator(AddressValidator):
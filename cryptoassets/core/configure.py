@@ -13,6 +13,8 @@ import yaml
 from zope.dottedname.resolve import resolve
 
 from sqlalchemy import engine_from_config
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
 
 from .coin.defaults import COIN_MODEL_DEFAULTS
 from .coin.registry import Coin
@@ -38,6 +40,23 @@ class ConfigurationError(Exception):
     """ConfigurationError is thrown when the Configurator thinks somethink cannot make sense with the config data."""
 
 
+def setup_sqlite_journal(engine, journal_mode="wal"):
+    """Set SQLite journaling pragmas on every new connection.
+
+    In WAL mode readers do not block the writer and vice versa, so the helper service threads and the application can access the same database file concurrently. In-memory databases ignore this. The ``synchronous`` setting is left to the SQLite default, so that committed transactions survive a power loss.
+
+    :param engine: SQLAlchemy engine using SQLite dialect
+
+    :param journal_mode: SQLite journal mode, e.g. ``wal`` or ``delete``
+    """
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode={}".format(journal_mode))
+        cursor.close()
+
+
 class Configurator:
     """Read configuration data and set up Cryptoassets library.
 
@@ -74,8 +93,23 @@ class Configurator:
         transaction_retries = configuration.pop("transaction_retries", 3)
         self.app.transaction_retries = transaction_retries
 
+        journal_mode = configuration.pop("sqlite_journal_mode", "wal")
+
         echo = configuration.get("echo") in (True, "true")
-        engine = engine_from_config(configuration, prefix="", echo=echo, isolation_level="SERIALIZABLE")
+        url = make_url(configuration["url"])
+
+        if url.drivername.startswith("sqlite"):
+            engine = engine_from_config(configuration, prefix="", echo=echo, isolation_level="SERIALIZABLE")
+            if journal_mode:
+                setup_sqlite_journal(engine, journal_mode)
+        else:
+            # Keep enough connections open for the service threads and the application, so that they do not need to connect per transaction
+            configuration.setdefault("pool_size", 10)
+            configuration.setdefault("max_overflow", 20)
+            # Recycle idle connections, so that long running services do not hold on to connections the database server has closed
+            configuration.setdefault("pool_recycle", 3600)
+            engine = engine_from_config(configuration, prefix="", echo=echo, isolation_level="SERIALIZABLE")
+
         return engine
 
     def setup_backend(self, coin, data):
@@ -97,6 +131,8 @@ class Configurator:
         provider = resolve(klass)
 
         max_tracked_incoming_confirmations = data.pop("max_tracked_incoming_confirmations", 15)
+        balance_batch_size = data.pop("balance_batch_size", None)
+        max_inflight = data.pop("max_inflight", None)
 
         # Pass given configuration options to the backend as is
         try:
@@ -109,6 +145,12 @@ class Configurator:
 
         assert isinstance(instance, CoinBackend)
 
+        if balance_batch_size:
+            instance.balance_batch_size = int(balance_batch_size)
+
+        if max_inflight:
+            instance.max_inflight = int(max_inflight)
+
         return instance
 
     def setup_model(self, module):
@@ -195,11 +237,12 @@ class Configurator:
             # Pass given configuration options to the backend as is
             try:
                 instance = provider(**data)
-            except TypeError as te:
+            except (TypeError, ValueError) as te:
                 # TODO: Here we reflect potential passwords from the configuration file
                 # back to the terminal
                 # TypeError: __init__() got an unexpected keyword argument 'network'
-                raise ConfigurationError("Could not initialize notifier {} with options {}".format(klass, data)) from te
+                # ValueError: option values the event handler does not accept
+                raise ConfigurationError("Could not initialize notifier {} with options {}: {}".format(klass, data, te)) from te
 
             assert isinstance(instance, EventHandler)
             notifier_registry.register(name, instance)
@@ -218,8 +261,9 @@ class Configurator:
 
         ip = config.get("ip", "127.0.0.1")
         port = int(config.get("port", "18881"))
+        broadcast_endpoint = config.get("broadcast_endpoint", False) in ("true", True)
 
-        server = status.StatusHTTPServer(ip, port)
+        server = status.StatusHTTPServer(ip, port, broadcast_endpoint=broadcast_endpoint)
         return server
 
     def setup_service(self, config):
@@ -233,6 +277,9 @@ class Configurator:
         if "broadcast_period" in config:
             self.service.broadcast_period = int(config["broadcast_period"])
 
+        if config.get("broadcast_max_outputs"):
+            self.service.broadcast_max_outputs = int(config["broadcast_max_outputs"])
+
     def load_from_dict(self, config):
         """ Load configuration from Python dictionary.
 
@@ -26,12 +26,12 @@ def txupdate(coin_name, transaction, network_transaction, transaction_type, txid
 
     :return: Event data as dict()
     """
-    assert type(coin_name) == str
-    assert type(address) == str
-    assert type(account) == int, "Expected account id as int, got {}".format(account)
-    assert type(transaction) == int
-    assert type(network_transaction) == int
-    assert type(transaction_type) == str
+    assert isinstance(coin_name, str)
+    assert isinstance(address, str)
+    assert isinstance(account, int), "Expected account id as int, got {}".format(account)
+    assert isinstance(transaction, int)
+    assert isinstance(network_transaction, int)
+    assert isinstance(transaction_type, str)
     assert amount
     assert amount > 0
     data = dict(transaction=transaction, network_transaction=network_transaction, txid=txid, account=account, address=address, amount=amount, credited=credited)
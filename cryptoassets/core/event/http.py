@@ -9,11 +9,17 @@ Configuration options
 :param class: Always ``cryptoassets.core.event.http.HTTPEventHandler``.
 
 :param url: Do a HTTP POST to this URL on a new event. Example: ``http://localhost:30000``.
+
+:param timeout: How many seconds to wait for the application to respond. Defaults to 30.
+
+The HTTP connection is kept alive between events. Failed connection attempts are retried twice.
 """
 
 import requests
 import logging
 
+from requests.adapters import HTTPAdapter
+
 from .base import EventHandler
 from .base import event_json_dumps
 
@@ -22,15 +28,23 @@ logger = logging.getLogger(__name__)
 
 class HTTPEventHandler(EventHandler):
 
-    def __init__(self, url):
+    def __init__(self, url, timeout=30):
         self.url = url
+        self.timeout = float(timeout)
+
+        # Reuse the connection to the application between events.
+        # Only connection errors are retried, as we cannot know if a failed POST was already processed.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(max_retries=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def trigger(self, event_name, data):
-        assert type(event_name) == str
+        assert isinstance(event_name, str)
 
         data = event_json_dumps(data)
 
-        resp = requests.post(self.url, data=dict(event_name=event_name, data=data, xdata=data))
+        resp = self.session.post(self.url, data=dict(event_name=event_name, data=data, xdata=data), timeout=self.timeout)
         if resp.status_code != 200:
             logger.error("Failed to call HTTP hook %s, status code %d", self.url, resp.status_code)
         else:
@@ -8,6 +8,8 @@ Configuration options
 
 :param callback: A dotted name to Python callback function fn(event_name, data) which will be called upon a notification. ``event_name`` is a string, ``data`` is a dict.
 
+When more than one event handler is configured, the callback is run in a worker thread of the event handler registry, not in the thread which posted the event. Do not rely on thread-local state, like a ``scoped_session``, being shared with the caller.
+
 """
 import logging
 
@@ -24,7 +26,12 @@ class InProcessEventHandler(EventHandler):
         """
         self.callback_dotted_name = callback
 
+        #: Resolved callback function. Resolved on the first event, as the application module might not be importable yet when the configuration is read.
+        self.func = None
+
     def trigger(self, event_name, data):
-        assert type(event_name) == str
-        func = resolve(self.callback_dotted_name)
+        assert isinstance(event_name, str)
+        func = self.func
+        if func is None:
+            func = self.func = resolve(self.callback_dotted_name)
         func(event_name, data)
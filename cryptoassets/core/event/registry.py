@@ -1,5 +1,8 @@
 
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
 
 logger = logging.getLogger(__name__)
@@ -9,9 +12,19 @@ class EventHandlerRegistry:
     """Maintain list of active event_handler_registry.
     """
 
+    #: How many handlers can be run at once when there are several of them
+    max_workers = 4
+
     def __init__(self):
         self.registry = {}
 
+        #: Immutable copy of the registered handlers, rebuilt on every change. Triggering iterates this, so handlers can be registered from another thread while an event is being posted.
+        self.handlers = ()
+
+        #: Worker threads shared by all events, created when first needed
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
     def register(self, name, notifier):
         """Register a notifier to be fired for new transaction events.
 
@@ -20,27 +33,68 @@ class EventHandlerRegistry:
         :param notifier: Instance of :py:class:`cryptocurrency.core.event_handler_registry.base.Notifier`.
         """
         self.registry[name] = notifier
+        self.handlers = tuple(self.registry.values())
 
     def get_all(self):
-        return self.registry.values()
+        return self.handlers
 
     def clear(self):
         self.registry.clear()
+        self.handlers = ()
+
+    def get_executor(self):
+        with self.executor_lock:
+            if not self.executor:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def shutdown(self):
+        """Stop the worker threads after the events being posted have been handled."""
+        with self.executor_lock:
+            executor = self.executor
+            self.executor = None
+
+        if executor:
+            executor.shutdown(wait=True)
 
     def trigger(self, event_name, data):
         """Post an event to all listeners.
 
         If any of the event handlers fails with an exception, log the exception and continue processing the event.
+
+        With several handlers they are run concurrently in the worker threads of this registry, so that one slow HTTP hook or script does not hold back the others. We return when all of them have finished. A single handler is run in the calling thread.
         """
-        handlers = self.get_all()
-        for instance in handlers:
-            logger.info("Posting event %s to notification handler %s", event_name, instance)
-            try:
-                instance.trigger(event_name, data)
-            except Exception as e:
-                # Do not let the event handler take us down
-                logger.error("Error calling event handler %s for event %s", instance, event_name)
-                logger.exception(e)
-
-        if len(handlers) == 0:
+        self.trigger_many(event_name, [data])
+
+    def trigger_many(self, event_name, datas):
+        """Post several events of the same type to all listeners.
+
+        Each handler receives the events in the given order. Handlers are run concurrently like in :py:meth:`trigger`, each handler taking the whole batch in one worker thread.
+
+        :param datas: List of event data dicts
+        """
+        handlers = self.handlers
+        if not handlers:
             logger.warn("No registered transaction notfication handlers")
+            return
+
+        if len(handlers) == 1:
+            self._trigger_all(handlers[0], event_name, datas)
+            return
+
+        executor = self.get_executor()
+        futures = [executor.submit(self._trigger_all, instance, event_name, datas) for instance in handlers]
+        wait(futures)
+
+    def _trigger_all(self, instance, event_name, datas):
+        for data in datas:
+            self._trigger_one(instance, event_name, data)
+
+    def _trigger_one(self, instance, event_name, data):
+        logger.info("Posting event %s to notification handler %s", event_name, instance)
+        try:
+            instance.trigger(event_name, data)
+        except Exception as e:
+            # Do not let the event handler take us down
+            logger.error("Error calling event handler %s for event %s", instance, event_name)
+            logger.exception(e)
@@ -15,15 +15,18 @@ Configuration options
 
 :param class: Always ``cryptoassets.core.event.script.ScriptEventHandler``.
 
-:param script: Executed shell command
+:param script: Executed command. The command line is run through ``/bin/sh``. A list of arguments is accepted as well, and is executed directly without a shell.
 
 :param log_output: If true send the output from the executed command to cryptoassets logs on INFO log level
+
+:param shell: Defaults to true. Set to false to split the command line to arguments once and execute it directly, which is faster than spawning a shell for each event. Pipes, redirects and variable expansion do not work then, and the script must be executable and start with a ``#!`` line.
 """
 
 import logging
 import json
 import subprocess
 import os
+import shlex
 
 from .base import EventHandler
 
@@ -36,20 +39,33 @@ class ScriptNotificationFailed(Exception):
 
 class ScriptEventHandler(EventHandler):
 
-    def __init__(self, script, log_output=False):
+    def __init__(self, script, log_output=False, shell=True):
         self.script = script
         self.log_output = log_output in ("true", True)
+        self.shell = shell in ("true", True)
+
+        if isinstance(script, list):
+            # Already split to arguments, nothing for a shell to do
+            self.args = list(script)
+            self.shell = False
+        elif not isinstance(script, str):
+            raise ValueError("ScriptEventHandler script must be a command line string or a list of arguments, got {!r}".format(script))
+        elif self.shell:
+            self.args = (script,)
+        else:
+            # Parse the command line only once, not on every event
+            self.args = shlex.split(script)
 
     def trigger(self, event_name, data):
-        assert type(event_name) == str
+        assert isinstance(event_name, str)
         data = json.dumps(data)
-        args = (self.script,)
+        args = self.args
 
         env = os.environ.copy()
         env["CRYPTOASSETS_EVENT_NAME"] = event_name
         env["CRYPTOASSETS_EVENT_DATA"] = data
 
-        p = subprocess.Popen(args, shell=True, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        p = subprocess.Popen(args, shell=self.shell, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
         stdout, stderr = p.communicate()
 
         if self.log_output:
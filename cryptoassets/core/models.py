@@ -8,10 +8,16 @@ See cryptoassets.coin modules for examples.
 """
 
 import datetime
+import logging
+import os
 from collections import Counter
 from decimal import Decimal
 
+import sqlalchemy
 from sqlalchemy.sql import func
+from sqlalchemy.sql import case
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy import Column
 from sqlalchemy import Integer
 from sqlalchemy import Numeric
@@ -20,21 +26,52 @@ from sqlalchemy import Date
 from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
 from sqlalchemy import Enum
+from sqlalchemy import Index
+from sqlalchemy import text
+from sqlalchemy import bindparam
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship
-from sqlalchemy.orm import scoped_session
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import contains_eager
 from sqlalchemy.orm.session import Session
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.schema import UniqueConstraint
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 
+#: Loader strategy for model relationships. Set ``CRYPTOASSETS_STRICT`` environment variable when running the tests to make any lazy relationship load which would hit the database raise an exception, so that new N+1 query patterns get caught. Loads served from the identity map are still allowed. Needs SQLAlchemy 1.1 or newer.
+RELATIONSHIP_LAZY = "raise_on_sql" if os.environ.get("CRYPTOASSETS_STRICT") else "select"
+
+if RELATIONSHIP_LAZY == "raise_on_sql" and tuple(int(part) for part in sqlalchemy.__version__.split(".")[:2]) < (1, 1):
+    raise RuntimeError("CRYPTOASSETS_STRICT needs SQLAlchemy 1.1 or newer, installed version is {}".format(sqlalchemy.__version__))
+
 
 def _now():
     return datetime.datetime.utcnow()
 
 
+class utcnow(FunctionElement):
+    """Current UTC time generated by the database.
+
+    Used as a server side default for ``created_at`` columns, so that rows inserted outside SQLAlchemy, e.g. by bulk loads, get a timestamp. Inserts through the models still fill in the timestamp in Python, as existing tables may lack the column default.
+    """
+    type = DateTime()
+
+
+@compiles(utcnow)
+def _default_utcnow(element, compiler, **kw):
+    # SQLite CURRENT_TIMESTAMP is in UTC. MySQL only accepts CURRENT_TIMESTAMP as DATETIME default and gives it in the connection time zone.
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, "postgresql")
+def _pg_utcnow(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
 class NotEnoughAccountBalance(Exception):
     """The user tried to send too much from a specific account. """
 
@@ -113,7 +150,7 @@ class GenericAccount(CoinDescriptionModel, CoinBackend):
     name = Column(String(255), )
 
     #: When this account was created
-    created_at = Column(DateTime, default=_now)
+    created_at = Column(DateTime, default=_now, server_default=utcnow())
 
     #: Then the balance was updated, or new address generated
     updated_at = Column(DateTime, onupdate=_now)
@@ -122,8 +159,15 @@ class GenericAccount(CoinDescriptionModel, CoinBackend):
     #: NOTE: Accuracy checked for bitcoin only
     balance = Column(Numeric(21, 8), default=0, nullable=False)
 
+    #: Running counter of automatically labeled receiving addresses, see :py:meth:`pick_next_receiving_address_label`
+    address_seq = Column(Integer, default=0, nullable=False)
+
+    #: Total of incoming transactions which have not reached enough confirmations to be credited yet
+    unconfirmed_balance = Column(Numeric(21, 8), default=0, nullable=False)
+
     def __init__(self):
         self.balance = 0
+        self.unconfirmed_balance = 0
 
     @declared_attr
     def __tablename__(cls):
@@ -135,7 +179,12 @@ class GenericAccount(CoinDescriptionModel, CoinBackend):
 
     @declared_attr
     def wallet(cls):
-        return relationship(cls.coin_description.wallet_model_name, backref="accounts")
+        return relationship(cls.coin_description.wallet_model_name, lazy=RELATIONSHIP_LAZY, backref="accounts")
+
+    @declared_attr
+    def __table_args__(cls):
+        table_name = cls.coin_description.account_table_name
+        return (UniqueConstraint('wallet_id', 'name', name='{}_wallet_name_uc'.format(table_name)),)
 
     def pick_next_receiving_address_label(self):
         """Generates a new receiving address label which is not taken yet.
@@ -144,39 +193,57 @@ class GenericAccount(CoinDescriptionModel, CoinBackend):
 
         Generated labels are not user-readable, they are only useful for admin and accounting purposes.
         """
+        return self.pick_next_receiving_address_labels(1)[0]
+
+    def pick_next_receiving_address_labels(self, count):
+        """Generates several new receiving address labels which are not taken yet.
+
+        The label numbers are reserved with one counter update, see :py:meth:`pick_next_receiving_address_label`.
+
+        :param count: How many labels to generate
+
+        :return: List of label strings
+        """
         session = Session.object_session(self)
 
-        Address = self.coin_description.Address
-        addresses = session.query(Address).filter(Address.account == self)
+        assert self.id
+        assert count > 0
+
+        # Bump the counter in the database, so that concurrent callers get different numbers
+        Account = self.__class__
+        session.query(Account).filter(Account.id == self.id).update({Account.address_seq: Account.address_seq + count}, synchronize_session=False)
+        session.expire(self, ["address_seq"])
+
+        last = self.address_seq
         friendly_date = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
-        return "Receiving address #{} for account #{} created at {}".format(addresses.count()+1, self.id, friendly_date)
+        return ["Receiving address #{} for account #{} created at {}".format(seq, self.id, friendly_date) for seq in range(last - count + 1, last + 1)]
 
     def get_unconfirmed_balance(self):
         """Get the balance of this incoming transactions balance.
 
         TODO: Move to its own subclass
 
-        TODO: Denormalize unconfirmed balances for faster look up?
+        The balance is maintained in :py:attr:`unconfirmed_balance` by :py:meth:`GenericWallet.deposit` as incoming transactions arrive and get credited.
 
         :return: Decimal
         """
-        session = Session.object_session(self)
+        return self.unconfirmed_balance or Decimal(0)
 
-        Transaction = self.coin_description.Transaction
-        NetworkTransaction = self.coin_description.NetworkTransaction
-        Address = self.coin_description.Address
+    def add_unconfirmed_balance(self, amount):
+        """Atomically adjust the denormalized unconfirmed balance in the database.
+
+        :param amount: Decimal, negative when an incoming transaction leaves the unconfirmed state
+        """
+        session = Session.object_session(self)
         Account = self.__class__
 
-        unconfirmed_amount = func.sum(Transaction.amount).label("unconfirmed_amount")
-        unconfirmed_amounts = session.query(unconfirmed_amount).join(NetworkTransaction).filter(NetworkTransaction.confirmations < NetworkTransaction.confirmation_count).join(Address).filter(Address.account == self)
+        assert self.id
 
-        results = unconfirmed_amounts.all()
-        assert len(results) == 1
-        # SQL might spit out None if no matching rows
-        return results[0][0] or Decimal(0)
+        session.query(Account).filter(Account.id == self.id).update({Account.unconfirmed_balance: Account.unconfirmed_balance + amount}, synchronize_session=False)
+        session.expire(self, ["unconfirmed_balance"])
 
     def __str__(self):
-        return "ACC:{} name:{} bal:{} wallet:{}".format(self.id, self.name, self.balance, self.wallet.id if self.wallet else "-")
+        return "ACC:{} name:{} bal:{} wallet:{}".format(self.id, self.name, self.balance, self.wallet_id or "-")
 
 
 class GenericAddress(CoinDescriptionModel):
@@ -210,7 +277,7 @@ class GenericAddress(CoinDescriptionModel):
     #: Received balance of this address. Only *confirmed* deposits count, filtered by GenericConfirmationTransaction.confirmations. For getting other balances, check ``get_balance_by_confirmations()``.
     #: NOTE: Numeric Accuracy checked for Bitcoin only ATM
     balance = Column(Numeric(21, 8), default=0, nullable=False)
-    created_at = Column(DateTime, default=_now)
+    created_at = Column(DateTime, default=_now, server_default=utcnow())
     updated_at = Column(DateTime, onupdate=_now)
 
     #: Archived addresses are no longer in active incoming transaction polling
@@ -226,6 +293,15 @@ class GenericAddress(CoinDescriptionModel):
         assert cls.coin_description.account_table_name
         return Column(Integer, ForeignKey(cls.coin_description.account_table_name + ".id"))
 
+    @declared_attr
+    def wallet_id(cls):
+        """Denormalized from the owner account, so that wallet address lookups do not need to join accounts. NULL for external addresses."""
+        return Column(Integer, ForeignKey(cls.coin_description.wallet_table_name + ".id"))
+
+    @declared_attr
+    def wallet(cls):
+        return relationship(cls.coin_description.wallet_model_name, lazy=RELATIONSHIP_LAZY, backref="addresses")
+
     def is_deposit(self):
         return self.account is not None
 
@@ -237,19 +313,20 @@ class GenericAddress(CoinDescriptionModel):
         This is None if the address is not a receiving addresses, but only exists in the network, outside our system.
         """
         assert cls.coin_description.account_model_name
-        return relationship(cls.coin_description.account_model_name, backref="addresses")
+        return relationship(cls.coin_description.account_model_name, lazy=RELATIONSHIP_LAZY, backref="addresses")
 
     def get_received_transactions(self, external=True, internal=True):
         """Get all transactions this address have received, both internal and external deposits."""
         session = Session.object_session(self)
         Transaction = self.coin_description.Transaction
 
-        q_internal = session.query(Transaction).filter(Transaction.sending_account != None, Transaction.receiving_account == self)  # noqa
+        q_internal = session.query(Transaction).filter(Transaction.sending_account != None, Transaction.receiving_account == self, Transaction.network_transaction == None)  # noqa
 
         q_external = session.query(Transaction).filter(Transaction.network_transaction != None, Transaction.address == self)  # noqa
 
         if internal and external:
-            return q_internal.union(q_external)
+            # The branches are disjoint on network_transaction, no need for the database to deduplicate
+            return q_internal.union_all(q_external)
         elif internal:
             return q_internal
         elif external:
@@ -266,30 +343,36 @@ class GenericAddress(CoinDescriptionModel):
 
             This is all time received balance, not balance left after spending.
 
+        Internal transactions between accounts do not have an address, so they are never counted.
+
         TODO: Move to its own subclass
 
         :param confirmations: Confirmation count as threshold
+
+        :param include_internal: Ignored, kept for backwards compatibility. Internal transactions are never counted.
         """
-        total = 0
+        session = Session.object_session(self)
+        Transaction = self.coin_description.Transaction
+        NetworkTransaction = self.coin_description.NetworkTransaction
 
-        for t in self.get_received_transactions():
-            if t.network_transaction:
-                if t.network_transaction.confirmations >= confirmations:
-                    total += t.amount
-            elif t.state == "internal":
-                assert t.receiving_account == self
-                total += t.amount
-            else:
-                raise RuntimeError("Cannot handle tx {}".format(t))
+        # Sum in the database, instead of loading every transaction and its network transaction
+        amount = func.coalesce(func.sum(Transaction.amount), 0)
 
-        return total
+        return session.query(amount).join(NetworkTransaction, Transaction.network_transaction_id == NetworkTransaction.id).filter(Transaction.address_id == self.id, NetworkTransaction.confirmations >= confirmations).scalar()
 
     @declared_attr
     def __table_args__(cls):
-        return (UniqueConstraint('account_id', 'address', name='_account_address_uc'),)
+        table_name = cls.coin_description.address_table_name
+        return (
+            UniqueConstraint('account_id', 'address', name='_account_address_uc'),
+            # Active receiving addresses of a wallet, see GenericWallet.get_receiving_addresses(), partial on PostgreSQL so it skips archived rows
+            Index('ix_{}_active'.format(table_name), 'wallet_id', 'archived_at', postgresql_where=text("archived_at IS NULL")),
+            # Look ups by the address string, the unique constraint above leads with account_id and cannot serve them
+            Index('ix_{}_address'.format(table_name), 'address'),
+        )
 
     def __str__(self):
-        return "Addr:{} [{}] deposit:{} account:{} balance:{} label:{} updated:{}".format(self.id, self.address, self.is_deposit(), self.account and self.account.id or "-", self.balance, self.label, self.updated_at)
+        return "Addr:{} [{}] deposit:{} account:{} balance:{} label:{} updated:{}".format(self.id, self.address, self.account_id is not None, self.account_id or "-", self.balance, self.label, self.updated_at)
 
 
 class GenericTransaction(CoinDescriptionModel):
@@ -330,7 +413,7 @@ class GenericTransaction(CoinDescriptionModel):
     id = Column(Integer, primary_key=True)
 
     #: When this transaction become visible in our database
-    created_at = Column(DateTime, default=_now)
+    created_at = Column(DateTime, default=_now, server_default=utcnow())
 
     #: When the incoming transaction was credited on the account.
     #: For internal transactions it is instantly.
@@ -403,39 +486,39 @@ class GenericTransaction(CoinDescriptionModel):
         For incoming transactions this is the Address object with the reference
         to the Account object who we credited for this transfer.
         """
-        return relationship(cls.coin_description.address_model_name,  # noqa
-            primaryjoin="{}.address_id == {}.id".format(cls.__name__, cls.coin_description.address_model_name),
+        return relationship(cls.coin_description.address_model_name, lazy=RELATIONSHIP_LAZY,  # noqa
+            primaryjoin=lambda: cls.address_id == cls.coin_description.Address.id,
             backref="transactions")
 
     @declared_attr
     def sending_account(cls):
         """ The account where the payment was made from.
         """
-        return relationship(cls.coin_description.account_model_name,  # noqa
-            primaryjoin="{}.sending_account_id == {}.id".format(cls.__name__, cls.coin_description.account_model_name),
+        return relationship(cls.coin_description.account_model_name, lazy=RELATIONSHIP_LAZY,  # noqa
+            primaryjoin=lambda: cls.sending_account_id == cls.coin_description.Account.id,
             backref="sent_transactions")
 
     @declared_attr
     def receiving_account(cls):
         """ The account which received the payment.
         """
-        return relationship(cls.coin_description.account_model_name,  # noqa
-            primaryjoin="{}.receiving_account_id == {}.id".format(cls.__name__, cls.coin_description.account_model_name),
+        return relationship(cls.coin_description.account_model_name, lazy=RELATIONSHIP_LAZY,  # noqa
+            primaryjoin=lambda: cls.receiving_account_id == cls.coin_description.Account.id,
             backref="received_transactions")
 
     @declared_attr
     def network_transaction(cls):
         """Associated cryptocurrency network transaction.
         """
-        return relationship(cls.coin_description.network_transaction_model_name,  # noqa
-            primaryjoin="{}.network_transaction_id == {}.id".format(cls.__name__, cls.coin_description.network_transaction_model_name),
+        return relationship(cls.coin_description.network_transaction_model_name, lazy=RELATIONSHIP_LAZY,  # noqa
+            primaryjoin=lambda: cls.network_transaction_id == cls.coin_description.NetworkTransaction.id,
             backref="transactions")
 
     @declared_attr
     def wallet(cls):
         """ Which Wallet object contains this transaction.
         """
-        return relationship(cls.coin_description.wallet_model_name, backref="transactions")
+        return relationship(cls.coin_description.wallet_model_name, lazy=RELATIONSHIP_LAZY, backref="transactions")
 
     def can_be_confirmed(self):
         """ Return if the transaction can be considered as final.
@@ -452,9 +535,24 @@ class GenericTransaction(CoinDescriptionModel):
             return self.network_transaction.txid
         return None
 
+    @declared_attr
+    def __table_args__(cls):
+        table_name = cls.coin_description.transaction_table_name
+        return (
+            # Outgoing queue scanned by GenericWallet.get_pending_outgoing_transactions(), partial on PostgreSQL so it only covers pending rows
+            Index('ix_{}_pending'.format(table_name), 'state', 'receiving_account_id', 'network_transaction_id', postgresql_where=text("state = 'pending'")),
+            # Deposit lookups in GenericWallet.deposit()
+            Index('ix_{}_ntx_address'.format(table_name), 'network_transaction_id', 'address_id'),
+        )
+
     def __str__(self):
+        # Use foreign key columns and only an already loaded network transaction,
+        # so that logging transactions does not trigger lazy loads
+        ntx = self.__dict__.get("network_transaction")
+        txid = ntx.txid if ntx else None
         # TODO: Move confirmations part to subclass
-        return "TX:{} state:{} txid:{} sending acco:{} receiving acco:{} amount:{}, confirms:{}".format(self.id, self.state, self.txid, self.sending_account and self.sending_account.id, self.receiving_account and self.receiving_account.id, self.amount, getattr(self, "confirmations", "-"))
+        confirmations = getattr(ntx, "confirmations", "-") if ntx else "-"
+        return "TX:{} state:{} ntx:{} txid:{} sending acco:{} receiving acco:{} amount:{}, confirms:{}".format(self.id, self.state, self.network_transaction_id, txid, self.sending_account_id, self.receiving_account_id, self.amount, confirmations)
 
 
 class GenericConfirmationTransaction(GenericTransaction):
@@ -524,6 +622,9 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
     #: NOTE: accuracy checked for Bitcoin only
     balance = Column(Numeric(21, 8))
 
+    #: How many external address ids we remember per session in :py:meth:`get_or_create_external_address`
+    EXTERNAL_ADDRESS_CACHE_SIZE = 256
+
     @declared_attr
     def __tablename__(cls):
         return cls.coin_description.wallet_table_name
@@ -539,7 +640,7 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         """
 
         assert wallet_id
-        assert type(wallet_id) == int
+        assert isinstance(wallet_id, int)
 
         instance = session.query(cls).get(wallet_id)
         return instance
@@ -552,7 +653,7 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         """
 
         assert name
-        assert type(name) == str
+        assert isinstance(name, str)
 
         instance = session.query(cls).filter_by(name=name).first()
 
@@ -580,14 +681,37 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         return account
 
     def get_account_by_name(self, name):
+        """Get an account by its name in this wallet.
+
+        The found account id is remembered for the lifetime of the session, so that looking up the same name again resolves the account from the identity map instead of doing a SELECT.
+
+        :return: Account object or None
+        """
         session = Session.object_session(self)
-        instance = session.query(self.coin_description.Account).filter_by(name=name).first()
+        Account = self.coin_description.Account
+
+        cache = session.info.setdefault("_account_name_cache", {})
+        cache_key = (Account.__tablename__, self.id, name)
+
+        account_id = cache.get(cache_key)
+        if account_id is not None:
+            account = session.query(Account).get(account_id)
+            # The account might have been renamed, or the transaction which created it rolled back
+            if account is not None and account.wallet_id == self.id and account.name == name:
+                return account
+            del cache[cache_key]
+
+        instance = session.query(Account).filter_by(wallet_id=self.id, name=name).first()
+        if instance is not None:
+            cache[cache_key] = instance.id
         return instance
 
     def get_or_create_account_by_name(self, name):
-        session = Session.object_session(self)
+        """Get an account by its name in this wallet, or create it.
 
-        instance = session.query(self.coin_description.Account).filter_by(name=name).first()
+        Account names are unique within a wallet, so if two transactions try to create the same account concurrently, one of them fails instead of creating a duplicate.
+        """
+        instance = self.get_account_by_name(name)
         if not instance:
             instance = self.create_account(name)
 
@@ -599,8 +723,17 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         This is for internal bookkeeping only. These fees MAY be
         charged from the users doing the actual transaction, but it
         must be solved on the application level.
+
+        The account lookup is memoized per session, see :py:meth:`get_account_by_name`.
         """
-        return self.get_or_create_account_by_name(self.coin_description.Account.NETWORK_FEE_ACCOUNT)
+        session = Session.object_session(self)
+        Account = self.coin_description.Account
+
+        account = self.get_or_create_account_by_name(Account.NETWORK_FEE_ACCOUNT)
+        if not account.id:
+            # Freshly created, flush so that the next lookup within this transaction finds it
+            session.flush()
+        return account
 
     def create_receiving_address(self, account, label=None, automatic_label=False):
         """ Creates a new receiving address.
@@ -613,7 +746,7 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
 
         :param label: Label for this address - must be human-readable
 
-        :return: GenericAddress object
+        :return: GenericAddress object. The row is not flushed here; it is inserted together with the other pending changes on the next session flush.
         """
 
         session = Session.object_session(self)
@@ -627,20 +760,53 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         if not label and automatic_label:
             label = account.pick_next_receiving_address_label()
 
-        try:
-            _address = self.backend.create_address(label=label)
-        except Exception as e:
-            raise CannotCreateAddress("Backend failed to create address for account {} label {}".format(account.id, label)) from e
+        return self.create_receiving_addresses(account, [label])[0]
 
-        address = self.coin_description.Address()
-        address.address = _address
-        address.account = account
-        address.label = label
-        address.wallet = self
+    def create_receiving_addresses(self, account, labels=None, count=None):
+        """ Creates several new receiving addresses for one account.
+
+        Use this when seeding an account with a pool of addresses. Each address is still generated by the backend one by one, but the database rows are added to the session together and inserted in one flush.
+
+        :param account: GenericAccount object
 
-        session.add(address)
+        :param labels: List of labels, one for each new address - must be human-readable
 
-        return address
+        :param count: Instead of ``labels``, create this many addresses with automatic labels
+
+        :return: List of GenericAddress objects in the order of ``labels``
+        """
+
+        session = Session.object_session(self)
+
+        assert session
+        assert account
+        assert account.id
+
+        assert (labels is None) != (count is None), "Give either labels or count"
+
+        if count is not None:
+            labels = account.pick_next_receiving_address_labels(count) if count > 0 else []
+
+        addresses = []
+
+        for label in labels:
+            assert label, "You must give explicit label for the address"
+
+            try:
+                _address = self.backend.create_address(label=label)
+            except Exception as e:
+                raise CannotCreateAddress("Backend failed to create address for account {} label {}".format(account.id, label)) from e
+
+            address = self.coin_description.Address()
+            address.address = _address
+            address.account = account
+            address.label = label
+            address.wallet = self
+            addresses.append(address)
+
+        session.add_all(addresses)
+
+        return addresses
 
     def get_or_create_external_address(self, address):
         """ Create an accounting entry for an address which is outside our system.
@@ -651,11 +817,32 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         :param address: Address as a string
         """
 
-        assert type(address) == str
+        assert isinstance(address, str)
 
         session = Session.object_session(self)
+        Address = self.coin_description.Address
+
+        # Remember resolved external address ids for the lifetime of the session,
+        # so repeated sends to the same address resolve from the identity map.
+        # We store ids, not instances, and fall back to SELECT if the row is gone.
+        cache = session.info.setdefault("_external_address_cache", {})
+        cache_key = (Address.__tablename__, address)
+
+        _address = None
+        address_id = cache.get(cache_key)
+        if address_id is not None:
+            _address = session.query(Address).get(address_id)
+            if _address is None or _address.address != address or _address.account_id is not None:
+                del cache[cache_key]
+                _address = None
+
+        if not _address:
+            _address = session.query(Address).filter_by(address=address, account_id=None).first()
+            if _address:
+                if len(cache) >= self.EXTERNAL_ADDRESS_CACHE_SIZE:
+                    cache.clear()
+                cache[cache_key] = _address.id
 
-        _address = session.query(self.coin_description.Address).filter_by(address=address, account_id=None).first()
         if not _address:
             _address = self.coin_description.Address()
             _address.address = address
@@ -687,7 +874,7 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         session = Session.object_session(self)
 
         assert isinstance(from_account, self.coin_description.Account)
-        assert type(receiving_address) == str
+        assert isinstance(receiving_address, str)
         assert isinstance(amount, Decimal)
 
         # TODO: Check minimal withdrawal amount
@@ -710,6 +897,8 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         :param account: Account instance
 
         :param address: Address instance
+
+        :return: GenericAddress object, inserted on the next session flush
         """
         session = Session.object_session(self)
 
@@ -719,6 +908,7 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         address_obj.address = address
         address_obj.account = account
         address_obj.label = label
+        address_obj.wallet = self
         session.add(address_obj)
         return address_obj
 
@@ -726,7 +916,8 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         session = Session.object_session(self)
         # Go through all accounts and all their addresses
 
-        return session.query(self.coin_description.Account).filter(self.coin_description.Account.wallet_id == self.id)  # noqa
+        Account = self.coin_description.Account
+        return session.query(Account).filter(Account.wallet_id == self.id)  # noqa
 
     def get_account_by_address(self, address):
         """Check if a particular address belongs to receiving address of this wallet and return its account.
@@ -736,11 +927,11 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         :return: Account instance or None if the wallet doesn't know about the address
         """
         session = Session.object_session(self)
-        addresses = session.query(self.coin_description.Address).filter(self.coin_description.Address.address == address).join(self.coin_description.Account).filter(self.coin_description.Account.wallet_id == self.id)  # noqa
-        _address = addresses.first()
-        if _address:
-            return _address.account
-        return None
+        Address = self.coin_description.Address
+        Account = self.coin_description.Account
+
+        # Select the owner account directly, the address row itself is not needed
+        return session.query(Account).join(Address, Address.account_id == Account.id).filter(Address.address == address, Address.wallet_id == self.id).first()
 
     def get_pending_outgoing_transactions(self):
         """Get the list of outgoing transactions which have not been associated with any broadcast yet."""
@@ -765,8 +956,23 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         if archived:
             raise RuntimeError("TODO")
 
-        # Go through all accounts and all their addresses
-        return session.query(self.coin_description.Address).filter(self.coin_description.Address.archived_at == None).join(self.coin_description.Account).filter(self.coin_description.Account.wallet_id == self.id)  # noqa
+        # Callers almost always look at the owning account next, load it in the same SELECT
+        Address = self.coin_description.Address
+        return session.query(Address).options(joinedload(Address.account)).filter(Address.wallet_id == self.id, Address.archived_at == None)  # noqa
+
+    def get_receiving_address_strings(self):
+        """ Get all active receiving addresses for this wallet as strings.
+
+        Same as :py:meth:`get_receiving_addresses`, but only loads the address column, so no ORM objects are constructed. Use this when you only need to know what addresses to monitor.
+
+        :return: List of address strings
+        """
+
+        session = Session.object_session(self)
+        Address = self.coin_description.Address
+
+        addresses = session.query(Address.address).filter(Address.wallet_id == self.id, Address.archived_at == None)  # noqa
+        return [address for address, in addresses]
 
     def get_deposit_transactions(self):
         """Get all deposit transactions to this wallet.
@@ -783,7 +989,8 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         Transaction = self.coin_description.Transaction
         NetworkTransaction = self.coin_description.NetworkTransaction
 
-        return session.query(Transaction).filter(Transaction.wallet == self).filter(Transaction.network_transaction_id != None).join(NetworkTransaction).filter(NetworkTransaction.transaction_type == "deposit")  # noqa
+        # Populate network_transaction from the join we already do and load the address along, so iterating deposits does not issue a SELECT per row
+        return session.query(Transaction).filter(Transaction.wallet == self).filter(Transaction.network_transaction_id != None).join(Transaction.network_transaction).filter(NetworkTransaction.transaction_type == "deposit").options(contains_eager(Transaction.network_transaction), joinedload(Transaction.address))  # noqa
 
     def get_active_external_received_transcations(self):
         """Return unconfirmed transactions which are still pending the network confirmations to be credited.
@@ -811,15 +1018,44 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         assert session
         assert account.wallet == self
 
-        addresses = session.query(self.coin_description.Address).filter(self.coin_description.Address.account == account).values("address")
+        Address = self.coin_description.Address
+        address_table = Address.__table__
+        update = address_table.update().where(address_table.c.id == bindparam("_id")).values(balance=bindparam("_balance"))
 
         total_balance = 0
-
-        # The backend might do exists checks using in operator
-        # to this, we cannot pass generator, thus list()
-        for address, balance in self.backend.get_balances(list(item.address for item in addresses)):
-            total_balance += balance
-            session.query(self.coin_description.Address).filter(self.coin_description.Address.address == address).update({"balance": balance})
+        batch_size = self.backend.balance_batch_size
+        last_id = 0
+
+        # Walk the addresses in id order one batch at a time, so that memory use does not grow with the wallet size
+        # and large wallets do not hit backend request size limits.
+        while True:
+            batch = session.query(Address.id, Address.address).filter(Address.account == account, Address.id > last_id).order_by(Address.id).limit(batch_size).all()
+            if not batch:
+                break
+
+            last_id = batch[-1][0]
+            addr_to_id = {address: address_id for address_id, address in batch}
+
+            # The backend might do exists checks using in operator
+            # to this, we cannot pass generator, thus list().
+            rows = []
+            for address, balance in self.backend.get_balances(list(addr_to_id.keys())):
+                total_balance += balance
+                address_id = addr_to_id.get(address)
+                if address_id is None:
+                    logger.warning("Backend returned balance for address %s we did not ask for, account %d", address, account.id)
+                    continue
+                rows.append({"_id": address_id, "_balance": balance})
+
+            # Write the batch back with one executemany UPDATE
+            if rows:
+                session.execute(update, rows)
+
+            # The UPDATE bypasses the ORM, make address objects already in the session reload their balance
+            for row in rows:
+                address = session.identity_map.get(identity_key(Address, row["_id"]))
+                if address is not None:
+                    session.expire(address, ["balance"])
 
         account.balance = total_balance
 
@@ -848,9 +1084,26 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         if from_account.id == to_account.id:
             raise SameAccount("Transaction receiving and sending internal account is same: #{}".format(from_account.id))
 
-        if not allow_negative_balance:
-            if from_account.balance < amount:
+        # Do the balance arithmetic in the database, so that concurrent transfers cannot work on stale balances.
+        # Pending balance changes must reach the database first, as we expire them below.
+        if session.is_modified(from_account) or session.is_modified(to_account):
+            session.flush()
+
+        Account = self.coin_description.Account
+        if allow_negative_balance:
+            # Change (and lock) both account rows in one statement
+            balance = case({from_account.id: Account.balance - amount, to_account.id: Account.balance + amount}, value=Account.id)
+            session.query(Account).filter(Account.id.in_([from_account.id, to_account.id])).update({"balance": balance}, synchronize_session=False)
+        else:
+            # Check and debit the sender in one conditional UPDATE, and only then credit the receiver
+            debited = session.query(Account).filter(Account.id == from_account.id, Account.balance >= amount).update({"balance": Account.balance - amount}, synchronize_session=False)
+            if not debited:
+                session.expire(from_account, ["balance"])
                 raise NotEnoughAccountBalance("Cannot send, needs {} account balance is {}", amount, from_account.balance)
+            session.query(Account).filter(Account.id == to_account.id).update({"balance": Account.balance + amount}, synchronize_session=False)
+
+        session.expire(from_account, ["balance"])
+        session.expire(to_account, ["balance"])
 
         transaction = self.coin_description.Transaction()
         transaction.sending_account = from_account
@@ -862,11 +1115,87 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         transaction.state = "internal"
         session.add(transaction)
 
-        from_account.balance -= amount
-        to_account.balance += amount
-
         return transaction
 
+    def send_internal_many(self, transfers, allow_negative_balance=False):
+        """Transfer between accounts of this wallet several times at once.
+
+        Same as :py:meth:`send_internal`, but all transaction rows are written with one executemany INSERT, no matter how many transfers there are. Transfers are checked in the given order, so an account may send coins it received earlier in the same batch. Each account whose balance goes down is debited with a conditional UPDATE, so concurrent batches cannot overdraw it.
+
+        The transactions are not loaded to the session. Query them if you need them.
+
+        :param transfers: Iterable of (from_account, to_account, amount, label) tuples
+
+        :return: Number of created transactions
+        """
+        session = Session.object_session(self)
+
+        transfers = list(transfers)
+        if not transfers:
+            return 0
+
+        now = _now()
+        balances = {}
+        accounts = {}
+        mappings = []
+
+        for from_account, to_account, amount, label in transfers:
+            assert from_account.wallet == self
+            assert to_account.wallet == self
+            assert from_account.id
+            assert to_account.id
+            assert isinstance(amount, Decimal)
+
+            if from_account.id == to_account.id:
+                raise SameAccount("Transaction receiving and sending internal account is same: #{}".format(from_account.id))
+
+            for account in (from_account, to_account):
+                if account.id not in accounts:
+                    accounts[account.id] = account
+                    balances[account.id] = account.balance
+
+            if not allow_negative_balance:
+                if balances[from_account.id] < amount:
+                    raise NotEnoughAccountBalance("Cannot send, needs {} account balance is {}", amount, balances[from_account.id])
+
+            balances[from_account.id] -= amount
+            balances[to_account.id] += amount
+
+            mappings.append(dict(sending_account_id=from_account.id, receiving_account_id=to_account.id, amount=amount, wallet_id=self.id, credited_at=now, label=label, state="internal"))
+
+        # Pending balance changes must reach the database first, as we expire them below
+        if any(session.is_modified(account) for account in accounts.values()):
+            session.flush()
+
+        Account = self.coin_description.Account
+        deltas = {account_id: balances[account_id] - account.balance for account_id, account in accounts.items()}
+
+        if allow_negative_balance:
+            credits = deltas
+        else:
+            credits = {account_id: delta for account_id, delta in deltas.items() if delta >= 0}
+
+            # Check and debit the senders in the database like send_internal() does, in id order to avoid deadlocks
+            for account_id in sorted(set(deltas) - set(credits)):
+                total = -deltas[account_id]
+                debited = session.query(Account).filter(Account.id == account_id, Account.balance >= total).update({"balance": Account.balance - total}, synchronize_session=False)
+                if not debited:
+                    for account in accounts.values():
+                        session.expire(account, ["balance"])
+                    raise NotEnoughAccountBalance("Cannot send, needs {} account balance is {}", total, accounts[account_id].balance)
+
+        if credits:
+            balance = case({account_id: Account.balance + delta for account_id, delta in credits.items()}, value=Account.id)
+            session.query(Account).filter(Account.id.in_(list(credits.keys()))).update({"balance": balance}, synchronize_session=False)
+
+        for account in accounts.values():
+            session.expire(account, ["balance"])
+
+        Transaction = self.coin_description.Transaction
+        session.execute(Transaction.__table__.insert(), mappings)
+
+        return len(mappings)
+
     def send_external(self, from_account, to_address, amount, label, testnet=False):
         """Create a new external transaction and put it to the transaction queue.
 
@@ -895,7 +1224,16 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         # TODO: Currently we don't allow
         # negative withdrawals on external sends
         #
-        if from_account.balance < amount:
+        # Check and debit the balance in one conditional UPDATE,
+        # so a concurrent send cannot drain the account in between.
+        # Pending balance changes must reach the database first, as we expire them below.
+        if from_account in session.new or session.is_modified(from_account):
+            session.flush()
+
+        Account = self.coin_description.Account
+        debited = session.query(Account).filter(Account.id == from_account.id, Account.balance >= amount).update({"balance": Account.balance - amount}, synchronize_session=False)
+        session.expire(from_account, ["balance"])
+        if not debited:
             raise NotEnoughAccountBalance()
 
         _address = self.get_or_create_external_address(to_address)
@@ -909,7 +1247,6 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         transaction.label = label
         session.add(transaction)
 
-        from_account.balance -= amount
         self.balance -= amount
 
         return transaction
@@ -931,10 +1268,6 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
 
         fee_account = self.get_or_create_network_fee_account()
 
-        # TODO: Not sure which one is better approach
-        # assert fee_account.id, "Fee account is not properly constructed, flush() DB"
-        session.flush()
-
         transaction = self.coin_description.Transaction()
         transaction.sending_account = fee_account
         transaction.receiving_account = None
@@ -986,20 +1319,82 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
         assert amount > 0, "Receiving transaction to {} with amount {}".format(address, amount)
         assert ntx
         assert ntx.id
-        assert type(address) == str
+        assert isinstance(address, str)
 
-        _address = session.query(self.coin_description.Address).filter(self.coin_description.Address.address == address).first()  # noqa
+        # Load the address and its owner account in one SELECT
+        Address = self.coin_description.Address
+        _address = session.query(Address).options(joinedload(Address.account)).filter(Address.address == address).first()
 
         assert _address, "Wallet {} does not have address {}".format(self.id, address)
         assert _address.id
 
-        # TODO: Have something smarter here after we use relationships
-        account = session.query(self.coin_description.Account).filter(self.coin_description.Account.id == _address.account_id).first()  # noqa
-        assert account.wallet == self
-
         # Check if we already have this transaction
         Transaction = self.coin_description.Transaction
-        transaction = session.query(Transaction).filter(Transaction.network_transaction_id == ntx.id, self.coin_description.Transaction.address_id == _address.id).first()
+        transaction = session.query(Transaction).filter(Transaction.network_transaction_id == ntx.id, Transaction.address_id == _address.id).first()
+
+        return self._deposit_to_address(ntx, _address, amount, transaction)
+
+    def deposit_many(self, ntx, deposits, extra=None):
+        """Informs the wallet about several outputs of one external incoming transaction.
+
+        Same as :py:meth:`deposit`, but the receiving addresses and the already known transactions are looked up with one query each, no matter how many addresses there are.
+
+        :param ntx: Associated :py:class:`cryptoassets.core.models.NetworkTransaction`
+
+        :param deposits: Iterable of (address string, amount) tuples. Each address must be a receiving address of this wallet.
+
+        :param extra: Extra variables to set on the transaction object as a dictionary. (Currently not used)
+
+        :return: List of (Account instance, new or existing Transaction object, credited boolean) tuples in the order of ``deposits``
+        """
+
+        session = Session.object_session(self)
+
+        assert self.id
+        assert ntx
+        assert ntx.id
+
+        deposits = list(deposits)
+        if not deposits:
+            return []
+
+        Address = self.coin_description.Address
+        Transaction = self.coin_description.Transaction
+
+        address_strings = [address for address, amount in deposits]
+        addresses = session.query(Address).options(joinedload(Address.account)).filter(Address.address.in_(address_strings), Address.account_id != None)  # noqa
+        addresses = {_address.address: _address for _address in addresses}
+
+        address_ids = [_address.id for _address in addresses.values()]
+        transactions = session.query(Transaction).filter(Transaction.network_transaction_id == ntx.id, Transaction.address_id.in_(address_ids))
+        transactions = {transaction.address_id: transaction for transaction in transactions}
+
+        results = []
+        for address, amount in deposits:
+            assert amount > 0, "Receiving transaction to {} with amount {}".format(address, amount)
+            assert isinstance(address, str)
+
+            _address = addresses.get(address)
+            assert _address, "Wallet {} does not have address {}".format(self.id, address)
+
+            results.append(self._deposit_to_address(ntx, _address, amount, transactions.get(_address.id)))
+
+        return results
+
+    def _deposit_to_address(self, ntx, _address, amount, transaction):
+        """Create or update the incoming transaction for one receiving address and credit the account if the transaction is confirmed.
+
+        :param transaction: Existing Transaction for this network transaction and address or None
+
+        :return: tuple (Account instance, new or existing Transaction object, credited boolean)
+        """
+
+        session = Session.object_session(self)
+
+        account = _address.account
+        assert account.wallet == self
+
+        created = transaction is None
 
         if not transaction:
             # We have not seen this transaction before in the database
@@ -1011,23 +1406,32 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
             transaction.amount = amount
         else:
             assert transaction.state in ("incoming", "credited")
-            assert transaction.sending_account is None
+            assert transaction.sending_account_id is None
 
         transaction.sending_account = None
         transaction.receiving_account = account
         session.add(transaction)
 
-        if not transaction.credited_at:
+        credited = transaction.credited_at is not None
+        if not credited:
 
             if transaction.can_be_confirmed():
                 # Consider this transaction to be confirmed and update the receiving account
                 transaction.credited_at = _now()
+                credited = True
                 account.balance += transaction.amount
                 _address.balance += transaction.amount
                 account.wallet.balance += transaction.amount
                 session.add(account)
 
-        return account, transaction
+                if not created:
+                    # Was counted as unconfirmed when we first saw it
+                    account.add_unconfirmed_balance(-transaction.amount)
+
+            elif created:
+                account.add_unconfirmed_balance(transaction.amount)
+
+        return account, transaction, credited
 
     def mark_transaction_processed(self, transaction_id):
         """ Mark that the transaction was processed by the client application.
@@ -1037,15 +1441,14 @@ class GenericWallet(CoinDescriptionModel, CoinBackend):
 
         session = Session.object_session(self)
 
-        assert type(transaction_id) == int
+        assert isinstance(transaction_id, int)
 
-        # Only non-archived addresses can receive transactions
-        transactions = session.query(self.coin_description.Transaction.id, self.coin_description.Transaction.state).filter(self.coin_description.Transaction.id == transaction_id, self.coin_description.Transaction.state == "incoming")  # noqa
-
-        # We should mark one and only one transaction processed
-        assert transactions.count() == 1
+        Transaction = self.coin_description.Transaction
+        transactions = session.query(Transaction).filter(Transaction.id == transaction_id, Transaction.state == "incoming")  # noqa
 
-        transactions.update(dict(state="processed", processed_at=_now()))
+        # We should mark one and only one transaction processed, let the UPDATE tell us instead of counting first
+        updated = transactions.update(dict(state="processed", processed_at=_now()))
+        assert updated == 1, "Transaction {} was not waiting to be processed".format(transaction_id)
 
 
 class GenericNetworkTransaction(CoinDescriptionModel):
@@ -1082,7 +1485,7 @@ class GenericNetworkTransaction(CoinDescriptionModel):
     id = Column(Integer, primary_key=True)
 
     #: When this transaction become visible in our database
-    created_at = Column(DateTime, default=_now)
+    created_at = Column(DateTime, default=_now, server_default=utcnow())
 
     #: Network transaction has associated with this transaction.
     #: E.g. Bitcoin transaction hash.
@@ -1145,6 +1548,14 @@ class GenericConfirmationNetworkTransaction(GenericNetworkTransaction):
     #: TODO: Make this configurable.
     confirmation_count = 3
 
+    @declared_attr
+    def __table_args__(cls):
+        table_name = cls.coin_description.network_transaction_table_name
+        return super(GenericConfirmationNetworkTransaction, cls).__table_args__ + (
+            # Open transactions polled by cryptoassets.core.tools.confirmationupdate
+            Index('ix_{}_confirmations'.format(table_name), 'confirmations'),
+        )
+
     def can_be_confirmed(self):
         """ Does this transaction have enough confirmations it could be confirmed by our standards. """
         return self.confirmations >= self.confirmation_count
@@ -13,11 +13,12 @@ Manages asynchronous tasks for sending and receiving cryptocurrency over various
 import sys
 import datetime
 import logging
-import time
+import random
 import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import pkg_resources
-from apscheduler.schedulers.background import BackgroundScheduler
 
 from ..app import CryptoAssetsApp
 from ..app import Subsystem
@@ -39,11 +40,24 @@ from . import defaultlogging
 #: Must be instiated after the logging configure is passed in
 logger = None
 
+#: cryptoassets.core package version, looked up once per process
+_version = None
+
+
+def get_version():
+    """Get cryptoassets.core package version.
+
+    Only look up the installed distribution. ``pkg_resources.require()`` would also resolve all the dependencies every time.
+    """
+    global _version
+    if _version is None:
+        _version = pkg_resources.get_distribution("cryptoassets.core").version
+    return _version
+
 
 def splash_version():
     """Log out cryptoassets.core package version."""
-    version = pkg_resources.require("cryptoassets.core")[0].version
-    logger.info("cryptoassets.core version %s", version)
+    logger.info("cryptoassets.core version %s", get_version())
 
 
 class Service:
@@ -71,13 +85,29 @@ class Service:
 
         #: coin name -> IncomingTransactionRunnable
         self.incoming_transaction_runnables = {}
+
+        #: coin name -> TransactionUpdater used by the confirmation update job
+        self.confirmation_updaters = {}
         self.running = False
+
+        #: Set when the service is asked to stop, wakes up the thread monitor right away
+        self.stop_requested = threading.Event()
+
         self.last_broadcast = None
         self.receive_scan_thread = None
 
+        #: Set by request_broadcast(), makes a running broadcast job do another pass
+        self.broadcast_requested = threading.Event()
+
+        #: APScheduler running timed jobs, set up only when broadcast subsystem is enabled
+        self.scheduler = None
+
         #: How often we check out for outgoing transactions
         self.broadcast_period = 30
 
+        #: How many outgoing transactions at most are merged to one broadcast, None for no limit
+        self.broadcast_max_outputs = None
+
         # List of active running threads
         self.threads = []
 
@@ -134,10 +164,35 @@ class Service:
         self.app.create_tables()
 
     def setup_jobs(self):
+        # Imported here, so that command line utilities not running jobs do not need to load APScheduler
+        from apscheduler.schedulers.background import BackgroundScheduler
+        from apscheduler.executors.pool import ThreadPoolExecutor as JobExecutor
+
         logger.debug("Setting up broadcast scheduled job")
-        self.scheduler = BackgroundScheduler()
-        self.broadcast_job = self.scheduler.add_job(self.poll_broadcast, 'interval', seconds=self.broadcast_period)
-        self.open_transaction_job = self.scheduler.add_job(self.poll_network_transaction_confirmations, 'interval', minutes=1)
+
+        # One worker per job is enough, as a job never runs in parallel with itself.
+        # Runs missed while the previous run was still going are collapsed to one.
+        self.scheduler = BackgroundScheduler(
+            executors={"default": JobExecutor(2)},
+            job_defaults={"coalesce": True, "max_instances": 1})
+        # Start the jobs at a random point of their first interval, so that several helper services
+        # started at the same moment do not all poll their backends at once
+        now = datetime.datetime.now()
+
+        # A run delayed by a slow previous run is still done late rather than skipped
+        self.broadcast_job = self.scheduler.add_job(self.poll_broadcast, 'interval', seconds=self.broadcast_period, misfire_grace_time=self.broadcast_period, next_run_time=now + datetime.timedelta(seconds=random.uniform(0, self.broadcast_period)))
+        self.open_transaction_job = self.scheduler.add_job(self.poll_network_transaction_confirmations, 'interval', minutes=1, next_run_time=now + datetime.timedelta(seconds=random.uniform(0, 60)))
+
+    def request_broadcast(self):
+        """Run the broadcast job right away instead of waiting for the next ``broadcast_period``.
+
+        Call this after queuing outgoing transactions from the same process. ``broadcast_period`` polling still picks up transactions queued by other processes.
+
+        If the broadcast job is already running, APScheduler skips the extra run. The running job then does one more pass when it is done.
+        """
+        self.broadcast_requested.set()
+        if self.scheduler and self.scheduler.running:
+            self.broadcast_job.modify(next_run_time=datetime.datetime.now())
 
     def start_status_server(self):
         """Start the status server on HTTP.
@@ -177,10 +232,12 @@ class Service:
         def term_handler(signum, frame):
             logger.info("Received SIGTERM")
             self.running = False
+            self.stop_requested.set()
 
         def keyboard_handler(signum, frame):
             logger.info("Received SIGINT")
             self.running = False
+            self.stop_requested.set()
 
             # Reove keyboard handler, so that CTRL+C twice does hard kill
             signal.signal(signal.SIGINT, old_sigint)
@@ -192,39 +249,95 @@ class Service:
     def poll_broadcast(self):
         """"A scheduled task to broadcast any new transactions to the bitcoin network.
 
-        Each wallet is broadcasted in its own transaction.
+        Pending outgoing transactions of each wallet are merged to one network transaction, or several if ``broadcast_max_outputs`` is set. Wallets without outgoing transactions are skipped.
+
+        Coins are broadcasted concurrently in worker threads, so that one slow backend does not hold back the others.
+
+        If :py:meth:`request_broadcast` is called during the pass, one more pass is done. Requests made during that pass wait for the next run.
         """
+        self.broadcast_requested.clear()
+        self.broadcast_coins()
+
+        if self.broadcast_requested.is_set():
+            self.broadcast_requested.clear()
+            self.broadcast_coins()
+
+    def broadcast_coins(self):
+        """Broadcast the pending outgoing transactions of all coins once."""
         self.last_broadcast = datetime.datetime.utcnow()
 
-        for name, coin in self.app.coins.all():
-            wallet_class = coin.wallet_model
+        coins = self.app.coins.all()
+        if len(coins) <= 1:
+            for item in coins:
+                self.broadcast_coin(item)
+            return
 
-            @self.app.conflict_resolver.managed_transaction
-            def create_broadcasters(session):
-                return [broadcast.Broadcaster(wallet, self.app.conflict_resolver, coin.backend) for wallet in session.query(wallet_class).all()]
+        with ThreadPoolExecutor(max_workers=len(coins)) as executor:
+            # Consume the results so that exceptions from the worker threads are raised here
+            list(executor.map(self.broadcast_coin, coins))
 
-            broadcasters = create_broadcasters()
+    def broadcast_coin(self, item):
+        """Broadcast outgoing transactions of all wallets of one coin.
 
-            for broadcaster in broadcasters:
-                broadcaster.do_broadcasts()
+        :param item: (name, coin) tuple
+        """
+        name, coin = item
+        wallet_class = coin.wallet_model
+
+        # Each managed transaction opens its own session, so this is safe to run in a worker thread
+        @self.app.conflict_resolver.managed_transaction
+        def create_broadcasters(session):
+            # Find the wallets with work in one query, instead of running the broadcast transactions for every wallet
+            wallet_ids = broadcast.get_broadcast_wallet_ids(session, wallet_class)
+            if not wallet_ids:
+                return []
+            wallets = session.query(wallet_class).filter(wallet_class.id.in_(list(wallet_ids)))
+            return [broadcast.Broadcaster(wallet, self.app.conflict_resolver, coin.backend, max_outputs=self.broadcast_max_outputs) for wallet in wallets]
+
+        broadcasters = create_broadcasters()
+
+        total_broadcasted = 0
+        for broadcaster in broadcasters:
+            broadcasted_count, fees = broadcaster.do_broadcasts()
+            total_broadcasted += broadcasted_count
+
+        # One summary per coin instead of per wallet lines
+        if broadcasters:
+            logger.info("Broadcasted %d network transactions for %d wallets of %s", total_broadcasted, len(broadcasters), name)
 
     def poll_network_transaction_confirmations(self):
         """Scan incoming open transactions.
 
+        Coins are updated concurrently in worker threads, like in :py:meth:`poll_broadcast`.
+
         :return: Number of rescans attempted
         """
 
-        rescans = 0
-        for name, coin in self.app.coins.all():
-            if coin.backend.require_tracking_incoming_confirmations():
+        coins = [item for item in self.app.coins.all() if item[1].backend.require_tracking_incoming_confirmations()]
+        if len(coins) <= 1:
+            for item in coins:
+                self.update_coin_confirmations(item)
+            return len(coins)
+
+        with ThreadPoolExecutor(max_workers=len(coins)) as executor:
+            # Consume the results so that exceptions from the worker threads are raised here
+            list(executor.map(self.update_coin_confirmations, coins))
+
+        return len(coins)
+
+    def update_coin_confirmations(self, item):
+        """Update confirmation counts of open network transactions of one coin.
 
-                max_confirmation_count = coin.max_confirmation_count
+        :param item: (name, coin) tuple
+        """
+        name, coin = item
 
-                tx_updater = coin.backend.create_transaction_updater(self.app.conflict_resolver, self.app.event_handler_registry)
-                confirmationupdate.update_confirmations(tx_updater, max_confirmation_count)
-                rescans += 1
+        # Reuse the updater between runs, so its stats cover the whole service lifetime
+        tx_updater = self.confirmation_updaters.get(name)
+        if not tx_updater:
+            tx_updater = self.confirmation_updaters[name] = coin.backend.create_transaction_updater(self.app.conflict_resolver, self.app.event_handler_registry)
 
-        return rescans
+        confirmationupdate.update_confirmations(tx_updater, coin.max_confirmation_count)
 
     def scan_received(self):
         """Scan through all received transactions, see if we missed some through walletnotify."""
@@ -263,7 +376,10 @@ class Service:
             return
 
     def run_thread_monitor(self):
-        """Run thread monitor until terminated by SIGTERM."""
+        """Run thread monitor until terminated by SIGTERM.
+
+        Threads are checked every three seconds. A signal wakes us up immediately.
+        """
         self.running = True
 
         while self.running:
@@ -271,7 +387,7 @@ class Service:
                 logger.fatal("Shutting down due to failed thread")
                 self.shutdown(unclean=True)
                 return 2
-            time.sleep(3.0)
+            self.stop_requested.wait(3.0)
 
         self.shutdown()
 
@@ -301,13 +417,17 @@ class Service:
 
         logger.info("Attempting shutdown of cryptoassets helper service, unclean %s", unclean)
         self.running = False
+        self.stop_requested.set()
 
         for runnable in self.incoming_transaction_runnables.values():
             runnable.stop()
 
-        if self.scheduler.running:
+        if self.scheduler and self.scheduler.running:
             self.scheduler.shutdown()
 
+        if self.app.event_handler_registry:
+            self.app.event_handler_registry.shutdown()
+
         logger.info("Attempting of shutdown status server")
         if self.app.status_server:
             self.app.status_server.stop()
@@ -6,16 +6,40 @@ This will allow one to see if backends are running properly and when was the las
 
 import os
 import threading
+import time
 import codecs
-from io import StringIO
 from io import BytesIO
 import logging
 
 from http.server import HTTPServer
 from http.server import BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from sqlalchemy.sql import func
+from sqlalchemy.sql import select
+from sqlalchemy.orm import contains_eager
 
 logger = logging.getLogger(__name__)
 
+#: How long (seconds) a rendered status page is served from memory, so that monitoring scripts polling the server do not hit the database and backends on every request
+STATUS_CACHE_SECONDS = 1.0
+
+#: How many rendered pages are kept at most. Pages differ by the ``X-Status-Server-Location`` header, which clients control.
+STATUS_CACHE_MAX_PAGES = 64
+
+#: How often (seconds) ``POST /broadcast`` is accepted at most, so that a client in a loop cannot keep the broadcast job running
+STATUS_BROADCAST_MIN_INTERVAL = 5.0
+
+#: How many rows status pages fetch from the database at a time, so that large tables are streamed instead of loaded into memory at once
+STATUS_BATCH_SIZE = 1000
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """Serve each status request in its own thread, so that one slow client does not block the others."""
+
+    # Request threads must not keep the service process alive at shutdown
+    daemon_threads = True
+
 
 class TableCreator:
     """Simple HTML tabular info renderer.
@@ -29,16 +53,11 @@ class TableCreator:
     def open(self, *columns):
         print("<style>th, td {text-align: left; vertical-align: top; padding-bottom: 0.5em; padding-right: 0.5em;}</style>", file=self.buffer)
         print("<table>", file=self.buffer)
-        print("<tr>", file=self.buffer)
-        for col in columns:
-            print("<th>{}</th>".format(col), file=self.buffer)
-        print("</tr>", file=self.buffer)
+        print("<tr>" + "".join("<th>{}</th>".format(col) for col in columns) + "</tr>", file=self.buffer)
 
     def row(self, *data):
-        print("<tr>", file=self.buffer)
-        for d in data:
-            print("<td>{}</td>".format(d), file=self.buffer)
-        print("</tr>", file=self.buffer)
+        # One write per row, tables can have thousands of them
+        print("<tr>" + "".join("<td>{}</td>".format(d) for d in data) + "</tr>", file=self.buffer)
 
     def close(self):
         print("</table>", file=self.buffer)
@@ -64,11 +83,18 @@ class StatusReportGenerator:
             t.open("Currency", "id", "name", "balance", "address count", "received tx count", "sent tx count")
             for coin_name, coin in self.service.app.coins.all():
                 Account = coin.account_model
-                # TODO: optimize counting
-                # http://stackoverflow.com/questions/19484059/sqlalchemy-query-for-object-with-count-of-relationship
-                for acc in session.query(Account).all():
-                    t.row(coin_name, acc.id, acc.name, acc.balance, len(acc.addresses), len(acc.received_transactions), len(acc.sent_transactions))
-                    output.flush()
+                Address = coin.address_model
+                Transaction = coin.transaction_model
+
+                # Count in the database, so that we do not load the related rows while streaming the accounts.
+                # The subqueries need labels, so that the result rows can tell them apart.
+                address_count = select([func.count(Address.id)]).where(Address.account_id == Account.id).correlate(Account).as_scalar().label("address_count")
+                received_count = select([func.count(Transaction.id)]).where(Transaction.receiving_account_id == Account.id).correlate(Account).as_scalar().label("received_count")
+                sent_count = select([func.count(Transaction.id)]).where(Transaction.sending_account_id == Account.id).correlate(Account).as_scalar().label("sent_count")
+
+                accounts = session.query(Account).with_entities(Account.id, Account.name, Account.balance, address_count, received_count, sent_count)
+                for row in accounts.yield_per(STATUS_BATCH_SIZE):
+                    t.row(coin_name, *row)
             t.close()
 
         tx()
@@ -81,12 +107,11 @@ class StatusReportGenerator:
             c.open("Currency", "id", "txid", "state", "amount", "label", "confirmations", "created_at", "credited_at", "processed_at", "wallet", "sending account", "receiving account")
             for coin_name, coin in self.service.app.coins.all():
                 Transaction = coin.transaction_model
-                # TODO: optimize counting
-                # http://stackoverflow.com/questions/19484059/sqlalchemy-query-for-object-with-count-of-relationship
-                for t in session.query(Transaction).all():
+                # Load the network transaction in the same query for txid and confirmations
+                transactions = session.query(Transaction).outerjoin(Transaction.network_transaction).options(contains_eager(Transaction.network_transaction))
+                for t in transactions.yield_per(STATUS_BATCH_SIZE):
                     # TODO: remove confirmations when cryptocurrency does not support it
-                    c.row(coin_name, t.id, t.txid, t.state, t.amount, t.label, t.confirmations, t.created_at, t.credited_at, t.processed_at, t.wallet.id, t.sending_account and t.sending_account.id, t.receiving_account and t.receiving_account.id)
-                    output.flush()
+                    c.row(coin_name, t.id, t.txid, t.state, t.amount, t.label, t.confirmations, t.created_at, t.credited_at, t.processed_at, t.wallet_id, t.sending_account_id, t.receiving_account_id)
             c.close()
 
         tx()
@@ -99,12 +124,9 @@ class StatusReportGenerator:
             c.open("Currency", "id", "transaction_type", "state", "txid", "confirmations", "created_at")
             for coin_name, coin in self.service.app.coins.all():
                 NetworkTransaction = coin.network_transaction_model
-                # TODO: optimize counting
-                # http://stackoverflow.com/questions/19484059/sqlalchemy-query-for-object-with-count-of-relationship
-                for t in session.query(NetworkTransaction).all():
+                for t in session.query(NetworkTransaction).yield_per(STATUS_BATCH_SIZE):
                     # TODO: remove confirmations when cryptocurrency does not support it
                     c.row(coin_name, t.id, t.transaction_type, t.state, t.txid, t.confirmations, t.created_at)
-                    output.flush()
             c.close()
 
         tx()
@@ -117,11 +139,8 @@ class StatusReportGenerator:
             t.open("Currency", "id", "address", "account_id", "name", "balance")
             for coin_name, coin in self.service.app.coins.all():
                 Address = coin.address_model
-                # TODO: optimize counting
-                # http://stackoverflow.com/questions/19484059/sqlalchemy-query-for-object-with-count-of-relationship
-                for addr in session.query(Address).all():
-                    t.row(coin_name, addr.id, addr.address, addr.account.id if addr.account else "(external)", addr.label, addr.balance)
-                    output.flush()
+                for addr in session.query(Address).yield_per(STATUS_BATCH_SIZE):
+                    t.row(coin_name, addr.id, addr.address, addr.account_id if addr.account_id else "(external)", addr.label, addr.balance)
             t.close()
 
         tx()
@@ -135,11 +154,13 @@ class StatusReportGenerator:
             t.open("Currency", "id", "accounts", "balance")
             for coin_name, coin in self.service.app.coins.all():
                 Wallet = coin.wallet_model
-                # TODO: optimize counting
-                # http://stackoverflow.com/questions/19484059/sqlalchemy-query-for-object-with-count-of-relationship
-                for w in session.query(Wallet).all():
-                    t.row(coin_name, w.id, len(w.accounts), w.balance)
-                    output.flush()
+                Account = coin.account_model
+
+                account_count = select([func.count(Account.id)]).where(Account.wallet_id == Wallet.id).correlate(Wallet).as_scalar().label("account_count")
+
+                wallets = session.query(Wallet).with_entities(Wallet.id, account_count, Wallet.balance)
+                for row in wallets.yield_per(STATUS_BATCH_SIZE):
+                    t.row(coin_name, *row)
             t.close()
 
         tx()
@@ -176,95 +197,160 @@ class StatusReportGenerator:
         raise RuntimeError("Test exception")
 
 
-class StatusHTTPServer(threading.Thread):
-    """
+class StatusGetHandler(BaseHTTPRequestHandler):
+    """Serve status pages of :py:class:`StatusReportGenerator` the server was started with."""
 
-    http://pymotw.com/2/BaseHTTPServer/
-    """
+    counter = 0
 
-    def __init__(self, ip, port):
-        threading.Thread.__init__(self)
-        self.httpd = None
-        self.status_report = None
-        self.ip = ip
-        self.port = port
-        self.running = False
-        self.ready = False
+    def nav(self, writer):
+        """
+        """
 
-    def start(self, report_generator):
+        # Allow upstream web server to tell in which location our pages are
+        prefix = self.headers.get('X-Status-Server-Location', "")
 
-        class StatusGetHandler(BaseHTTPRequestHandler):
+        def link(href, name):
+            print("<a href='{}{}'>[ {} ]</a> ".format(prefix, href, name), file=writer)
 
-            counter = 0
+        print("<p>", file=writer)
+        link("/", "Main")
+        link("/accounts", "Accounts")
+        link("/addresses", "Addresses")
+        link("/transactions", "Transactions")
+        link("/wallets", "Wallets")
+        link("/network_transactions", "Network transactions")
+        print("</p>", file=writer)
 
-            def nav(self, writer):
-                """
-                """
+    def do_GET(self):
+        """Handle responses to status pages."""
 
-                # Allow upstream web server to tell in which location our pages are
-                prefix = self.headers.get('X-Status-Server-Location', "")
+        # Allow upstream web server to tell in which location our pages are
+        prefix = self.headers.get('X-Status-Server-Location', "")
+        report_generator = self.server.report_generator
 
-                def link(href, name):
-                    print("<a href='{}{}'>[ {} ]</a> ".format(prefix, href, name), file=writer)
+        # What pages we serve
+        paths = {
+            "{}/".format(prefix): report_generator.index,
+            "{}/accounts".format(prefix): report_generator.accounts,
+            "{}/addresses".format(prefix): report_generator.addresses,
+            "{}/transactions".format(prefix): report_generator.transactions,
+            "{}/wallets".format(prefix): report_generator.wallets,
+            "{}/network_transactions".format(prefix): report_generator.network_transactions,
+            "{}/error".format(prefix): report_generator.error,
+        }
 
-                print("<p>", file=writer)
-                link("/", "Main")
-                link("/accounts", "Accounts")
-                link("/addresses", "Addresses")
-                link("/transactions", "Transactions")
-                link("/wallets", "Wallets")
-                link("/network_transactions", "Network transactions")
-                print("</p>", file=writer)
+        func = paths.get(self.path)
+        if not func:
+            self.send_error(404)
+            return
 
-            def do_GET(self):
-                """Handle responses to status pages."""
+        cache_key = (func.__name__, prefix)
+        with self.server.page_cache_lock:
+            cached = self.server.page_cache.get(cache_key)
+        if cached and time.monotonic() - cached[0] < STATUS_CACHE_SECONDS:
+            self.send_page(cached[1])
+            return
 
-                # Allow upstream web server to tell in which location our pages are
-                prefix = self.headers.get('X-Status-Server-Location', "")
+        buf = BytesIO()
+
+        try:
+            # http://www.macfreek.nl/memory/Encoding_of_Python_stdout
+            writer = codecs.getwriter('utf-8')(buf, 'strict')
+            self.nav(writer)
+            func(writer)
+
+        except Exception as e:
+            logger.error("Could not process page %s: %s", self.path, e)
+            logger.exception(e)
+            self.send_response(500, "Internal server error")
+            self.send_header("Content-type", "text/html; charset=utf-8")
+            self.end_headers()
+            return
+
+        page = buf.getvalue()
+        now = time.monotonic()
+        with self.server.page_cache_lock:
+            page_cache = self.server.page_cache
+            # Drop expired pages, so that varying prefixes do not pile up
+            for key in [key for key, (rendered_at, _) in page_cache.items() if now - rendered_at >= STATUS_CACHE_SECONDS]:
+                del page_cache[key]
+            if len(page_cache) < STATUS_CACHE_MAX_PAGES:
+                page_cache[cache_key] = (now, page)
+
+        self.send_page(page)
+
+    def send_page(self, page):
+        self.send_response(200, "OK")
+        self.send_header("Content-type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.send_header("Cache-Control", "max-age={}".format(int(STATUS_CACHE_SECONDS)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def do_POST(self):
+        """Handle requests to run service tasks right away."""
+
+        prefix = self.headers.get('X-Status-Server-Location', "")
+
+        # Read-only unless enabled in the config
+        if not self.server.broadcast_endpoint or self.path != "{}/broadcast".format(prefix):
+            self.send_error(404)
+            return
+
+        now = time.monotonic()
+        with self.server.broadcast_lock:
+            last = self.server.last_broadcast_request
+            if last is not None and now - last < STATUS_BROADCAST_MIN_INTERVAL:
+                self.send_error(429, "Too many broadcast requests")
+                return
+            self.server.last_broadcast_request = now
+
+        self.server.report_generator.service.request_broadcast()
+
+        self.send_response(202, "Accepted")
+        self.end_headers()
 
-                # What pages we serve
-                paths = {
-                    "{}/".format(prefix): report_generator.index,
-                    "{}/accounts".format(prefix): report_generator.accounts,
-                    "{}/addresses".format(prefix): report_generator.addresses,
-                    "{}/transactions".format(prefix): report_generator.transactions,
-                    "{}/wallets".format(prefix): report_generator.wallets,
-                    "{}/network_transactions".format(prefix): report_generator.network_transactions,
-                    "{}/error".format(prefix): report_generator.error,
-                }
 
-                func = paths.get(self.path)
-                if not func:
-                    self.send_error(404)
-                    return
+class StatusHTTPServer(threading.Thread):
+    """
 
-                buf = BytesIO()
+    http://pymotw.com/2/BaseHTTPServer/
+    """
 
-                try:
-                    # http://www.macfreek.nl/memory/Encoding_of_Python_stdout
-                    writer = codecs.getwriter('utf-8')(buf, 'strict')
-                    self.nav(writer)
-                    func(writer)
+    def __init__(self, ip, port, broadcast_endpoint=False):
+        """
+        :param ip: IP address to listen to
 
-                except Exception as e:
-                    logger.error("Could not process page %s: %s", self.path, e)
-                    logger.exception(e)
-                    self.send_response(500, "Internal server error")
-                    self.send_header("Content-type", "text/html; charset=utf-8")
-                    self.end_headers()
-                    return
-
-                self.send_response(200, "OK")
-                self.send_header("Content-type", "text/html; charset=utf-8")
-                self.end_headers()
-                self.wfile.write(buf.getvalue())
+        :param port: Port to listen to
 
+        :param broadcast_endpoint: Accept ``POST /broadcast`` to broadcast outgoing transactions right away
+        """
+        threading.Thread.__init__(self)
+        self.httpd = None
+        self.status_report = None
+        self.ip = ip
+        self.port = port
+        self.broadcast_endpoint = broadcast_endpoint
+        self.running = False
+        self.ready = False
+
+    def start(self, report_generator):
         server_address = (self.ip, self.port)
         try:
-            self.httpd = HTTPServer(server_address, StatusGetHandler)
+            self.httpd = ThreadingHTTPServer(server_address, StatusGetHandler)
         except OSError as e:
             raise RuntimeError("Could not start cryptoassets helper service status server at {}:{}".format(self.ip, self.port)) from e
 
+        self.httpd.report_generator = report_generator
+
+        # (page name, location prefix) -> (monotonic timestamp, rendered page)
+        self.httpd.page_cache = {}
+        self.httpd.page_cache_lock = threading.Lock()
+
+        self.httpd.broadcast_endpoint = self.broadcast_endpoint
+        self.httpd.last_broadcast_request = None
+        self.httpd.broadcast_lock = threading.Lock()
+
         threading.Thread.start(self)
 
     def run(self):
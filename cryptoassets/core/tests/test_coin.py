@@ -4,6 +4,7 @@ from zope.dottedname.resolve import resolve
 
 from ..coin import defaults
 from ..coin import registry
+from ..coin.validate import HashAddresValidator
 from ..backend.null import DummyCoinBackend
 
 from . import testlogging
@@ -40,6 +41,17 @@ class ValidatorTestCase(unittest.TestCase):
         btctest = self.load_default_coin("btc", True)
         self.assertFalse(btctest.validate_address("ZZCounterpartyXXXXXXXXXXXXXXW24Hef"))
 
+    def test_validation_cache(self):
+        """Repeated addresses are validated from the cache."""
+        validator = HashAddresValidator()
+        self.assertTrue(validator.validate_address("1HHHoqFc4qNXs61zYCFgDmT8sDzzxFaFQq", False))
+        self.assertTrue(validator.validate_address("1HHHoqFc4qNXs61zYCFgDmT8sDzzxFaFQq", False))
+        self.assertFalse(validator.validate_address("1HHHoqFc4qNXs61zYCFgDmT8sDzzxFaFQr", False))
+        self.assertEqual(validator.cached_check_bc.cache_info().hits, 1)
+
+        with self.assertRaises(ValueError):
+            validator.validate_address("0HHHoqFc4qNXs61zYCFgDmT8sDzzxFaFQq", False)
+
     def test_dogecoin(self):
         doge = self.load_default_coin("doge", False)
         self.assertTrue(doge.validate_address("DT8gpWajoMN1MSyfg7Wocgv7L92UD4MBAo"))
@@ -16,6 +16,7 @@ from http.server import BaseHTTPRequestHandler
 from ..app import CryptoAssetsApp
 from ..app import Subsystem
 from ..configure import Configurator
+from ..configure import ConfigurationError
 
 from . import testlogging
 from . import testwarnings
@@ -27,7 +28,7 @@ testlogging.setup()
 
 SAMPLE_SCRIPT_PATH = "/tmp/cryptoassets-test_notifier.sh"
 
-SAMPLE_SCRIPT = """#/bin/sh
+SAMPLE_SCRIPT = """#!/bin/sh
 echo Foo
 echo $0
 echo $CRYPTOASSETS_EVENT_NAME
@@ -53,6 +54,10 @@ class ScriptNotificationTestCase(unittest.TestCase):
         st = os.stat(SAMPLE_SCRIPT_PATH)
         os.chmod(SAMPLE_SCRIPT_PATH, st.st_mode | stat.S_IEXEC)
 
+        # Do not pick up the output of an earlier run
+        if os.path.exists("/tmp/cryptoassets-test_notifier"):
+            os.remove("/tmp/cryptoassets-test_notifier")
+
     def tearDown(self):
         danglingthreads.check_dangling_threads()
 
@@ -74,6 +79,35 @@ class ScriptNotificationTestCase(unittest.TestCase):
             data = json.load(f)
             self.assertEqual(data["test"], "abc")
 
+    def test_notify_no_shell(self):
+        """Run the script directly, without a shell."""
+        config = {
+            "test_script": {
+                "class": "cryptoassets.core.event.script.ScriptEventHandler",
+                "script": SAMPLE_SCRIPT_PATH,
+                "shell": False,
+            }
+        }
+        event_handler_registry = self.configurator.setup_event_handlers(config)
+
+        event_handler_registry.trigger("foobar", {"test": "abc"})
+
+        with io.open("/tmp/cryptoassets-test_notifier", "rt") as f:
+            data = json.load(f)
+            self.assertEqual(data["test"], "abc")
+
+    def test_bad_script(self):
+        """Script must be a string or a list."""
+        config = {
+            "test_script": {
+                "class": "cryptoassets.core.event.script.ScriptEventHandler",
+                "script": True,
+            }
+        }
+
+        with self.assertRaisesRegex(ConfigurationError, "True"):
+            self.configurator.setup_event_handlers(config)
+
 
 _cb_data = None
 
@@ -83,6 +117,24 @@ def global_recording_callback(event_name, data):
     _cb_data = data
 
 
+_cb_threads = []
+
+
+def global_thread_recording_callback(event_name, data):
+    _cb_threads.append(threading.current_thread().name)
+
+
+_cb_events = []
+
+
+def global_event_recording_callback(event_name, data):
+    _cb_events.append(data["n"])
+
+
+def global_failing_callback(event_name, data):
+    raise RuntimeError("Handler failure")
+
+
 class PythonNotificationTestCase(unittest.TestCase):
     """Test in-process Python notifications.
     """
@@ -109,6 +161,62 @@ class PythonNotificationTestCase(unittest.TestCase):
 
         self.assertEqual(_cb_data["test"], "abc")
 
+    def test_notify_many(self):
+        """Several handlers are run concurrently and a failing one does not stop the others.
+        """
+        config = {
+            "test_fail": {
+                "class": "cryptoassets.core.event.python.InProcessEventHandler",
+                "callback": "cryptoassets.core.tests.test_event_handler.global_failing_callback",
+            },
+            "test_python": {
+                "class": "cryptoassets.core.event.python.InProcessEventHandler",
+                "callback": "cryptoassets.core.tests.test_event_handler.global_thread_recording_callback",
+            },
+            "test_python2": {
+                "class": "cryptoassets.core.event.python.InProcessEventHandler",
+                "callback": "cryptoassets.core.tests.test_event_handler.global_thread_recording_callback",
+            }
+        }
+        event_handler_registry = self.configurator.setup_event_handlers(config)
+
+        del _cb_threads[:]
+        event_handler_registry.trigger("foobar", {"test": "abc"})
+
+        self.assertEqual(len(_cb_threads), 2)
+        self.assertNotIn(threading.current_thread().name, _cb_threads)
+
+        event_handler_registry.shutdown()
+
+    def test_notify_batch(self):
+        """Handlers receive a batch of events in order."""
+        config = {
+            "test_fail": {
+                "class": "cryptoassets.core.event.python.InProcessEventHandler",
+                "callback": "cryptoassets.core.tests.test_event_handler.global_failing_callback",
+            },
+            "test_python": {
+                "class": "cryptoassets.core.event.python.InProcessEventHandler",
+                "callback": "cryptoassets.core.tests.test_event_handler.global_event_recording_callback",
+            }
+        }
+        event_handler_registry = self.configurator.setup_event_handlers(config)
+
+        del _cb_events[:]
+        event_handler_registry.trigger_many("foobar", [{"n": 1}, {"n": 2}, {"n": 3}])
+
+        self.assertEqual(_cb_events, [1, 2, 3])
+
+        # Worker threads are kept for the next events until shut down
+        executor = event_handler_registry.executor
+        self.assertIsNotNone(executor)
+        event_handler_registry.trigger("foobar", {"n": 4})
+        self.assertIs(event_handler_registry.executor, executor)
+        self.assertEqual(_cb_events, [1, 2, 3, 4])
+
+        event_handler_registry.shutdown()
+        self.assertIsNone(event_handler_registry.executor)
+
 
 class DummyHandler(BaseHTTPRequestHandler):
 
@@ -1,10 +1,20 @@
+import datetime
+import io
 import os
 import unittest
 from decimal import Decimal
+from unittest.mock import patch
+from unittest.mock import Mock
 
 from ..app import CryptoAssetsApp
 from ..configure import Configurator
 from ..models import BadAddress
+from ..models import NotEnoughAccountBalance
+from ..backend.null import DummyCoinBackend
+from ..tools.broadcast import Broadcaster
+from ..tools.broadcast import get_broadcast_wallet_ids
+from ..service.status import StatusReportGenerator
+from ..tools import confirmationupdate
 
 from . import testwarnings
 from . import testlogging
@@ -113,7 +123,7 @@ class GenericWalletTestCase(unittest.TestCase):
             # Create deposit
             ntx, created = NetworkTransaction.get_or_create_deposit(session, "foobar")
             session.flush()
-            account, transaction = wallet.deposit(ntx, receiving_addr.address, Decimal(20), extra=dict(confirmations=999))
+            account, transaction, credited = wallet.deposit(ntx, receiving_addr.address, Decimal(20), extra=dict(confirmations=999))
             session.flush()
             assert account
             assert transaction.id
@@ -149,6 +159,33 @@ class GenericWalletTestCase(unittest.TestCase):
             desposits = wallet.get_deposit_transactions()
             self.assertEqual(desposits.count(), 1)
 
+    def test_mark_transaction_processed(self):
+        """Incoming transaction can be marked processed only once."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+            NetworkTransaction = self.app.coins.get("btc").network_transaction_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account = wallet.get_or_create_account_by_name("account1")
+            session.flush()
+            receiving_addr = wallet.create_receiving_address(account, "test incoming")
+
+            ntx, created = NetworkTransaction.get_or_create_deposit(session, "foobar")
+            session.flush()
+            account, transaction, credited = wallet.deposit(ntx, receiving_addr.address, Decimal(20))
+            session.flush()
+
+            wallet.mark_transaction_processed(transaction.id)
+            session.expire(transaction)
+            self.assertEqual(transaction.state, "processed")
+            self.assertTrue(transaction.processed_at)
+
+            with self.assertRaises(AssertionError):
+                wallet.mark_transaction_processed(transaction.id)
+
     def test_get_unconfirmed_balance(self):
         """Check balance of incoming transctions."""
 
@@ -178,13 +215,579 @@ class GenericWalletTestCase(unittest.TestCase):
             # Create deposit to account1
             ntx, created = NetworkTransaction.get_or_create_deposit(session, "foobar")
             session.flush()
-            account, transaction = wallet.deposit(ntx, receiving_addr.address, Decimal(20), extra=dict(confirmations=1))
+            account, transaction, credited = wallet.deposit(ntx, receiving_addr.address, Decimal(20), extra=dict(confirmations=1))
             session.flush()
 
             # Create deposit to account2
             ntx, created = NetworkTransaction.get_or_create_deposit(session, "foobar")
             session.flush()
-            account, transaction = wallet.deposit(ntx, receiving_addr_2.address, Decimal(30), extra=dict(confirmations=1))
+            account, transaction, credited = wallet.deposit(ntx, receiving_addr_2.address, Decimal(30), extra=dict(confirmations=1))
             session.flush()
+            self.assertFalse(credited)
 
             self.assertEqual(account1.get_unconfirmed_balance(), Decimal(20))
+
+            # The deposit gets enough confirmations and moves to the confirmed balance
+            ntx.confirmations = ntx.confirmation_count
+            account, transaction, credited = wallet.deposit(ntx, receiving_addr.address, Decimal(20), extra=dict(confirmations=ntx.confirmation_count))
+            session.flush()
+            self.assertTrue(credited)
+
+            self.assertEqual(account1.get_unconfirmed_balance(), Decimal(0))
+            self.assertEqual(account2.get_unconfirmed_balance(), Decimal(30))
+
+    def test_refresh_account_balance(self):
+        """Address balances reported by the backend are written back to the database."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+            Address = self.app.coins.get("btc").address_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account1 = wallet.get_or_create_account_by_name("account1")
+            session.flush()
+
+            addr1 = wallet.create_receiving_address(account1, "test incoming 1")
+            addr2 = wallet.create_receiving_address(account1, "test incoming 2")
+            session.flush()
+
+            balances = [(addr1.address, Decimal(10)), (addr2.address, Decimal(20))]
+            with patch.object(DummyCoinBackend, "get_balances", return_value=balances):
+                wallet.refresh_account_balance(account1)
+            session.flush()
+
+            self.assertEqual(account1.balance, Decimal(30))
+            self.assertEqual(session.query(Address.balance).filter(Address.id == addr1.id).scalar(), Decimal(10))
+            self.assertEqual(session.query(Address.balance).filter(Address.id == addr2.id).scalar(), Decimal(20))
+            self.assertEqual(addr1.balance, Decimal(10))
+            self.assertEqual(addr2.balance, Decimal(20))
+
+    def test_external_address_cache(self):
+        """Repeated lookups of the same external address resolve to the same row."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            addr = wallet.get_or_create_external_address("foobar2")
+            session.flush()
+
+            self.assertEqual(wallet.get_or_create_external_address("foobar2").id, addr.id)
+            self.assertIn(addr.id, session.info["_external_address_cache"].values())
+
+            # Stale cache entries fall back to SELECT
+            session.delete(addr)
+            session.flush()
+            addr2 = wallet.get_or_create_external_address("foobar2")
+            session.flush()
+            self.assertNotEqual(addr2.id, None)
+
+    def test_broadcast_outputs(self):
+        """Outgoing transactions to the same address are merged to one broadcast output."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+            Transaction = self.app.coins.get("btc").transaction_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account = wallet.get_or_create_account_by_name("account1")
+            account.balance = Decimal(100)
+            session.flush()
+
+            wallet.send_external(account, "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", Decimal(1), "test 1")
+            wallet.send_external(account, "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", Decimal(2), "test 2")
+            wallet.send_external(account, "1dice8EMZmqKvrGE4Qc9bUFf9PX3xaYDp", Decimal(3), "test 3")
+            session.flush()
+
+        with patch.object(DummyCoinBackend, "send", create=True, return_value=("txid1", None)) as send:
+            broadcaster = Broadcaster(wallet, self.app.conflict_resolver, wallet.backend)
+            broadcasted_count, fees = broadcaster.do_broadcasts()
+
+        self.assertEqual(broadcasted_count, 1)
+        outputs = send.call_args[0][0]
+        self.assertEqual(outputs, {"1BoatSLRHtKNngkdXEeobR76b53LETtpyT": Decimal(3), "1dice8EMZmqKvrGE4Qc9bUFf9PX3xaYDp": Decimal(3)})
+
+        with self.app.conflict_resolver.transaction() as session:
+            states = set(state for state, in session.query(Transaction.state))
+            self.assertEqual(states, {"broadcasted"})
+
+            NetworkTransaction = self.app.coins.get("btc").network_transaction_model
+            broadcast = session.query(NetworkTransaction).one()
+            self.assertEqual(broadcast.txid, "txid1")
+            self.assertEqual(broadcast.state, "broadcasted")
+            self.assertIsNotNone(broadcast.closed_at)
+
+    def test_broadcast_max_outputs(self):
+        """Outgoing transactions are split to several broadcasts when max_outputs is set."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account = wallet.get_or_create_account_by_name("account1")
+            account.balance = Decimal(100)
+            session.flush()
+
+            for i in range(5):
+                wallet.send_external(account, "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", Decimal(1), "test {}".format(i))
+            session.flush()
+
+        with patch.object(DummyCoinBackend, "send", create=True, side_effect=[("txid1", None), ("txid2", None), ("txid3", None)]) as send:
+            broadcaster = Broadcaster(wallet, self.app.conflict_resolver, wallet.backend, max_outputs=2)
+            self.assertEqual(broadcaster.collect_for_broadcast(), 5)
+            broadcasted_count, fees = broadcaster.send_broadcasts()
+
+        self.assertEqual(broadcasted_count, 3)
+        amounts = sorted(call[0][0]["1BoatSLRHtKNngkdXEeobR76b53LETtpyT"] for call in send.call_args_list)
+        self.assertEqual(amounts, [Decimal(1), Decimal(2), Decimal(2)])
+
+    def test_get_broadcast_wallet_ids(self):
+        """Only wallets with outgoing transactions need broadcasting."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            wallet2 = wallet_class.get_or_create_by_name("foobar2", session)
+            session.flush()
+            self.assertEqual(get_broadcast_wallet_ids(session, wallet_class), set())
+
+            account = wallet2.get_or_create_account_by_name("account1")
+            account.balance = Decimal(100)
+            session.flush()
+
+            wallet2.send_external(account, "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", Decimal(1), "test 1")
+            session.flush()
+            self.assertEqual(get_broadcast_wallet_ids(session, wallet_class), {wallet2.id})
+
+    def test_charge_network_fees(self):
+        """Network fees are accounted on one fee account across broadcasts."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+            NetworkTransaction = self.app.coins.get("btc").network_transaction_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            broadcast = NetworkTransaction()
+            broadcast.transaction_type = "broadcast"
+            broadcast.txid = "txid1"
+            broadcast.state = "broadcasted"
+            session.add(broadcast)
+
+            wallet.charge_network_fees(broadcast, Decimal(1))
+            wallet.charge_network_fees(broadcast, Decimal(2))
+            session.flush()
+
+            fee_account = wallet.get_or_create_network_fee_account()
+            self.assertEqual(fee_account.balance, Decimal(-3))
+            self.assertEqual(wallet.get_accounts().count(), 1)
+
+    def test_get_receiving_address_strings(self):
+        """Receiving addresses can be listed as plain strings."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account = wallet.create_account("account1")
+            session.flush()
+            addr = wallet.create_receiving_address(account, "test incoming")
+            wallet.get_or_create_external_address("foobar2")
+            session.flush()
+
+            self.assertEqual(wallet.get_receiving_address_strings(), [addr.address])
+
+            # Filled in by the database
+            self.assertIsInstance(addr.created_at, datetime.datetime)
+
+    def test_refresh_account_balance_batches(self):
+        """Balances are asked from the backend in batches."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account1 = wallet.get_or_create_account_by_name("account1")
+            session.flush()
+
+            addresses = [wallet.create_receiving_address(account1, "test incoming {}".format(i)) for i in range(3)]
+            session.flush()
+
+            def get_balances(addresses):
+                return [(address, Decimal(1)) for address in addresses]
+
+            with patch.object(DummyCoinBackend, "balance_batch_size", 2), patch.object(DummyCoinBackend, "get_balances", side_effect=get_balances) as mocked:
+                wallet.refresh_account_balance(account1)
+
+            self.assertEqual(mocked.call_count, 2)
+            self.assertEqual(account1.balance, Decimal(3))
+
+            # Address objects already in the session see the new balances
+            self.assertEqual([address.balance for address in addresses], [Decimal(1)] * 3)
+
+            # Addresses the backend gives back in a different form are skipped
+            def get_balances_unknown(addresses):
+                return [(address.upper(), Decimal(2)) for address in addresses]
+
+            with patch.object(DummyCoinBackend, "get_balances", side_effect=get_balances_unknown):
+                wallet.refresh_account_balance(account1)
+
+            self.assertEqual([address.balance for address in addresses], [Decimal(1)] * 3)
+
+    def test_get_or_create_account_by_name_per_wallet(self):
+        """Account names are looked up within the wallet."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            wallet2 = wallet_class.get_or_create_by_name("foobar2", session)
+            session.flush()
+
+            account = wallet.get_or_create_account_by_name("account1")
+            session.flush()
+            account2 = wallet2.get_or_create_account_by_name("account1")
+            session.flush()
+
+            self.assertNotEqual(account.id, account2.id)
+            self.assertEqual(wallet.get_or_create_account_by_name("account1").id, account.id)
+            self.assertEqual(wallet2.get_account_by_name("account1").id, account2.id)
+
+    def test_get_account_by_name_renamed(self):
+        """Memoized account lookups notice renamed accounts."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account = wallet.create_account("account1")
+            session.flush()
+            self.assertEqual(wallet.get_account_by_name("account1"), account)
+
+            account.name = "account2"
+            session.flush()
+            self.assertIsNone(wallet.get_account_by_name("account1"))
+            self.assertEqual(wallet.get_account_by_name("account2"), account)
+
+    def test_deposit_many(self):
+        """Deposit several outputs of one network transaction at once."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+            NetworkTransaction = self.app.coins.get("btc").network_transaction_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account1 = wallet.get_or_create_account_by_name("account1")
+            account2 = wallet.get_or_create_account_by_name("account2")
+            session.flush()
+
+            addr1 = wallet.create_receiving_address(account1, "test incoming 1")
+            addr2 = wallet.create_receiving_address(account2, "test incoming 2")
+            session.flush()
+
+            ntx, created = NetworkTransaction.get_or_create_deposit(session, "foobar")
+            ntx.confirmations = 999
+            session.flush()
+
+            results = wallet.deposit_many(ntx, [(addr1.address, Decimal(10)), (addr2.address, Decimal(20))])
+            session.flush()
+
+            self.assertEqual([account.id for account, transaction, credited in results], [account1.id, account2.id])
+            self.assertIn("ntx:{}".format(ntx.id), str(results[0][1]))
+            self.assertIn("account:{}".format(account1.id), str(addr1))
+            self.assertEqual(account1.balance, Decimal(10))
+            self.assertEqual(account2.balance, Decimal(20))
+
+            # Repeated updates do not credit twice
+            results2 = wallet.deposit_many(ntx, [(addr1.address, Decimal(10)), (addr2.address, Decimal(20))])
+            session.flush()
+
+            self.assertEqual([transaction.id for account, transaction, credited in results2], [transaction.id for account, transaction, credited in results])
+            self.assertEqual(account1.balance, Decimal(10))
+            self.assertEqual(wallet.balance, Decimal(30))
+
+    def test_send_external_not_enough_balance(self):
+        """External send checks and debits the account balance atomically."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account = wallet.get_or_create_account_by_name("account1")
+            account.balance = Decimal(5)
+            session.flush()
+
+            wallet.send_external(account, "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", Decimal(3), "test 1")
+            self.assertEqual(account.balance, Decimal(2))
+
+            def test():
+                wallet.send_external(account, "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", Decimal(3), "test 2")
+
+            self.assertRaises(NotEnoughAccountBalance, test)
+            self.assertEqual(account.balance, Decimal(2))
+
+    def test_send_internal_not_enough_balance(self):
+        """Internal send checks and debits the sender balance atomically."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account1 = wallet.get_or_create_account_by_name("account1")
+            account2 = wallet.get_or_create_account_by_name("account2")
+            account1.balance = Decimal(5)
+            session.flush()
+
+            wallet.send_internal(account1, account2, Decimal(3), "test 1")
+
+            def test():
+                wallet.send_internal(account1, account2, Decimal(3), "test 2")
+
+            self.assertRaises(NotEnoughAccountBalance, test)
+            self.assertEqual(account1.balance, Decimal(2))
+            self.assertEqual(account2.balance, Decimal(3))
+
+            wallet.send_internal(account1, account2, Decimal(3), "test 3", allow_negative_balance=True)
+            self.assertEqual(account1.balance, Decimal(-1))
+            self.assertEqual(account2.balance, Decimal(6))
+
+    def test_send_internal_many(self):
+        """Several internal transfers are written at once."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+            Transaction = self.app.coins.get("btc").transaction_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account1 = wallet.get_or_create_account_by_name("account1")
+            account2 = wallet.get_or_create_account_by_name("account2")
+            account3 = wallet.get_or_create_account_by_name("account3")
+            session.flush()
+            account1.balance = Decimal(10)
+
+            # account2 forwards the coins it receives in the same batch
+            count = wallet.send_internal_many([(account1, account2, Decimal(6), "a"), (account2, account3, Decimal(4), "b")])
+            self.assertEqual(count, 2)
+
+            self.assertEqual(account1.balance, Decimal(4))
+            self.assertEqual(account2.balance, Decimal(2))
+            self.assertEqual(account3.balance, Decimal(4))
+            self.assertEqual(session.query(Transaction).filter(Transaction.state == "internal").count(), 2)
+
+            def test():
+                wallet.send_internal_many([(account3, account1, Decimal(3), "c"), (account3, account2, Decimal(3), "d")])
+
+            self.assertRaises(NotEnoughAccountBalance, test)
+            self.assertEqual(account3.balance, Decimal(4))
+
+            # Another batch has spent the coins after we loaded the account, the database balance wins
+            Account = self.app.coins.get("btc").account_model
+            self.assertEqual(account1.balance, Decimal(4))
+            session.query(Account).filter(Account.id == account1.id).update({"balance": Decimal(1)}, synchronize_session=False)
+
+            def test_stale():
+                wallet.send_internal_many([(account1, account2, Decimal(3), "e")])
+
+            self.assertRaises(NotEnoughAccountBalance, test_stale)
+            self.assertEqual(account1.balance, Decimal(1))
+
+    def test_create_receiving_addresses(self):
+        """Create a batch of receiving addresses for an account."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account = wallet.create_account("account1")
+            session.flush()
+
+            addresses = wallet.create_receiving_addresses(account, ["test 1", "test 2", "test 3"])
+            session.flush()
+
+            self.assertEqual([address.label for address in addresses], ["test 1", "test 2", "test 3"])
+            self.assertEqual(wallet.get_receiving_addresses().count(), 3)
+            self.assertTrue(all(address.account == account for address in addresses))
+
+            addresses = wallet.create_receiving_addresses(account, count=2)
+            session.flush()
+
+            self.assertEqual(len(addresses), 2)
+            self.assertIn("#1 ", addresses[0].label)
+            self.assertIn("#2 ", addresses[1].label)
+            self.assertEqual(wallet.get_receiving_addresses().count(), 5)
+
+    def test_get_balance_by_confirmations(self):
+        """Address received balance is filtered by the confirmation count."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+            NetworkTransaction = self.app.coins.get("btc").network_transaction_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account = wallet.create_account("account1")
+            session.flush()
+
+            addr = wallet.create_receiving_address(account, "test incoming")
+            session.flush()
+
+            self.assertEqual(addr.get_balance_by_confirmations(0), Decimal(0))
+
+            ntx, created = NetworkTransaction.get_or_create_deposit(session, "foobar")
+            ntx.confirmations = 1
+            session.flush()
+            wallet.deposit(ntx, addr.address, Decimal(20))
+            session.flush()
+
+            self.assertEqual(addr.get_balance_by_confirmations(0), Decimal(20))
+            self.assertEqual(addr.get_balance_by_confirmations(1), Decimal(20))
+            self.assertEqual(addr.get_balance_by_confirmations(2), Decimal(0))
+
+    def test_get_balance_by_confirmations_internal(self):
+        """Internal transfers to the account with the same id as the address are not counted."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account1 = wallet.create_account("account1")
+            account2 = wallet.create_account("account2")
+            session.flush()
+
+            addr = wallet.create_receiving_address(account1, "test incoming")
+            session.flush()
+            self.assertEqual(addr.id, account1.id)
+
+            account2.balance = Decimal(10)
+            wallet.send_internal(account2, account1, Decimal(5), "test")
+            session.flush()
+
+            self.assertEqual(addr.get_balance_by_confirmations(0), Decimal(0))
+            self.assertEqual(addr.get_balance_by_confirmations(0, include_internal=True), Decimal(0))
+
+    def test_update_confirmations(self):
+        """Open deposits are looked up in batches and all fired events are counted."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+            NetworkTransaction = self.app.coins.get("btc").network_transaction_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account = wallet.create_account("account1")
+            session.flush()
+
+            addr = wallet.create_receiving_address(account, "test incoming")
+            session.flush()
+
+            txids = ["txid{}".format(i) for i in range(3)]
+            for txid in txids:
+                ntx, created = NetworkTransaction.get_or_create_deposit(session, txid)
+                ntx.confirmations = 0
+                session.flush()
+                wallet.deposit(ntx, addr.address, Decimal(1))
+
+            address = addr.address
+
+        def get_transaction(txid):
+            return {"confirmations": 1, "details": [{"category": "receive", "address": address, "amount": Decimal(1)}]}
+
+        backend = self.app.coins.get("btc").backend
+        transaction_updater = backend.create_transaction_updater(self.app.conflict_resolver, None)
+
+        with patch.object(confirmationupdate, "BATCH_SIZE", 2), \
+                patch.object(DummyCoinBackend, "get_transaction", side_effect=get_transaction, create=True), \
+                patch.object(DummyCoinBackend, "to_internal_amount", side_effect=lambda amount: amount, create=True), \
+                patch.object(DummyCoinBackend, "get_transactions", autospec=True, side_effect=lambda self, txids: {txid: get_transaction(txid) for txid in txids}) as get_transactions:
+            self.assertEqual(confirmationupdate.update_confirmations(transaction_updater, 5), 3)
+
+        self.assertEqual(get_transactions.call_count, 2)
+
+        # Nothing changed since
+        with patch.object(DummyCoinBackend, "get_transaction", side_effect=get_transaction, create=True), \
+                patch.object(DummyCoinBackend, "to_internal_amount", side_effect=lambda amount: amount, create=True):
+            self.assertEqual(confirmationupdate.update_confirmations(transaction_updater, 5), 0)
+
+        # Nothing open
+        self.assertEqual(confirmationupdate.update_confirmations(transaction_updater, 1), 0)
+
+    def test_timestamp_server_defaults(self):
+        """Timestamp column defaults are valid DDL on all supported databases."""
+
+        from sqlalchemy.schema import CreateTable
+        from sqlalchemy.dialects import mysql
+        from sqlalchemy.dialects import postgresql
+        from sqlalchemy.dialects import sqlite
+
+        Account = self.app.coins.get("btc").account_model
+
+        def ddl(dialect):
+            return str(CreateTable(Account.__table__).compile(dialect=dialect))
+
+        # Newer SQLAlchemy versions put expression defaults in parentheses on SQLite
+        self.assertRegex(ddl(sqlite.dialect()), r"created_at DATETIME DEFAULT \(?CURRENT_TIMESTAMP\)?,")
+        self.assertIn("created_at DATETIME DEFAULT CURRENT_TIMESTAMP", ddl(mysql.dialect()))
+        self.assertIn("created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT TIMEZONE('utc', CURRENT_TIMESTAMP)", ddl(postgresql.dialect()))
+
+    def test_status_report_counts(self):
+        """Status pages count related rows in the database."""
+
+        with self.app.conflict_resolver.transaction() as session:
+            wallet_class = self.app.coins.get("btc").wallet_model
+
+            wallet = wallet_class.get_or_create_by_name("foobar", session)
+            session.flush()
+
+            account1 = wallet.get_or_create_account_by_name("account1")
+            account2 = wallet.get_or_create_account_by_name("account2")
+            session.flush()
+            wallet.create_receiving_address(account1, "test incoming 1")
+            wallet.create_receiving_address(account1, "test incoming 2")
+            account1.balance = Decimal(10)
+            wallet.send_internal(account1, account2, Decimal(3), "test")
+
+        report_generator = StatusReportGenerator(Mock(app=self.app), self.app.conflict_resolver)
+
+        output = io.StringIO()
+        report_generator.accounts(output)
+        rows = output.getvalue()
+        self.assertIn("<td>{}</td><td>account1</td><td>7.00000000</td><td>2</td><td>0</td><td>1</td>".format(account1.id), rows)
+        self.assertIn("<td>{}</td><td>account2</td><td>3.00000000</td><td>0</td><td>1</td><td>0</td>".format(account2.id), rows)
+
+        output = io.StringIO()
+        report_generator.wallets(output)
+        self.assertIn("<td>{}</td><td>2</td>".format(wallet.id), output.getvalue())
+
+        # Pages without counts still render
+        for page in (report_generator.transactions, report_generator.addresses, report_generator.network_transactions):
+            page(io.StringIO())
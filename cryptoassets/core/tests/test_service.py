@@ -128,6 +128,14 @@ class ServiceTestCase(unittest.TestCase):
                 report = requests.get("http://localhost:{}/error".format(config["status_server"]["port"]))
                 self.assertEqual(report.status_code, 500)
 
+            # Ask for an immediate broadcast
+            report = requests.post("http://localhost:{}/broadcast".format(config["status_server"]["port"]))
+            self.assertEqual(report.status_code, 202)
+
+            # Repeated requests are throttled
+            report = requests.post("http://localhost:{}/broadcast".format(config["status_server"]["port"]))
+            self.assertEqual(report.status_code, 429)
+
         finally:
 
             service.shutdown()
@@ -1,12 +1,23 @@
 import os
+import struct
 import time
 import unittest
 import subprocess
 
 from unittest.mock import patch
+from unittest.mock import Mock
 
 import redis
 
+from bitcoinrpc.authproxy import JSONRPCException
+
+try:
+    import zmq
+except ImportError:
+    # pyzmq is an optional dependency
+    zmq = None
+
+from ..backend.bitcoind import BitcoindJSONError
 from ..backend.pipewalletnotify import PipedWalletNotifyHandler
 from ..backend.httpwalletnotify import HTTPWalletNotifyHandler
 from ..backend.httpwalletnotify import WalletNotifyRequestHandler
@@ -58,6 +69,52 @@ class WalletNotifyTestCase(unittest.TestCase):
 
         self.walletnotify_pipe.stop()
 
+    def test_piped_walletnotify_queue(self):
+        """Check that the same txid is not queued twice while waiting for a worker or being handled."""
+
+        walletnotify_pipe = PipedWalletNotifyHandler(None, WALLETNOTIFY_PIPE + "_test_piped_walletnotify_queue")
+        walletnotify_pipe.queue_tx_update("faketransactionid")
+        walletnotify_pipe.queue_tx_update("faketransactionid")
+        walletnotify_pipe.queue_tx_update("faketransactionid2")
+        self.assertEqual(walletnotify_pipe.queue.qsize(), 2)
+
+        # Picked up by a worker, the next notify is queued again
+        walletnotify_pipe.queue.put(None)
+        walletnotify_pipe.run_worker()
+        walletnotify_pipe.queue_tx_update("faketransactionid")
+        self.assertEqual(walletnotify_pipe.queue.qsize(), 1)
+
+        # Notified again while being handled, the same worker handles it once more instead of queuing it for another worker
+        handled = []
+
+        def handle_tx_update(txid):
+            handled.append(txid)
+            if len(handled) == 1:
+                walletnotify_pipe.queue_tx_update(txid)
+                self.assertEqual(walletnotify_pipe.queue.qsize(), 1)
+
+        with patch.object(walletnotify_pipe, "handle_tx_update", side_effect=handle_tx_update):
+            walletnotify_pipe.queue.put(None)
+            walletnotify_pipe.run_worker()
+
+        self.assertEqual(handled, ["faketransactionid", "faketransactionid"])
+        self.assertEqual(walletnotify_pipe.queued, set())
+
+    def test_piped_walletnotify_queue_stop(self):
+        """Check that a full queue does not keep a stopped handler waiting."""
+
+        walletnotify_pipe = PipedWalletNotifyHandler(None, WALLETNOTIFY_PIPE + "_test_piped_walletnotify_queue_stop", queue_size=1)
+        walletnotify_pipe.queue_tx_update("faketransactionid")
+
+        # Full, dropped once stopped
+        walletnotify_pipe.stop()
+        walletnotify_pipe.queue_tx_update("faketransactionid2")
+        self.assertEqual(walletnotify_pipe.queued, {"faketransactionid"})
+
+        self.assertEqual(walletnotify_pipe.discard_queued(), 1)
+        self.assertEqual(walletnotify_pipe.queue.qsize(), 0)
+        self.assertEqual(walletnotify_pipe.queued, set())
+
     def test_http_walletnotify(self):
         """Check that we receive txids through HTTP server."""
 
@@ -122,3 +179,94 @@ class WalletNotifyTestCase(unittest.TestCase):
         finally:
 
             self.walletnotify_server.stop()
+
+    @unittest.skipIf(zmq is None, "pyzmq is not installed")
+    def test_zmq_walletnotify(self):
+        """Check that we receive txids through ZeroMQ."""
+
+        from ..backend.zmqwalletnotify import ZMQWalletNotifyHandler
+
+        context = zmq.Context()
+        publisher = context.socket(zmq.PUB)
+        port = publisher.bind_to_random_port("tcp://127.0.0.1")
+
+        transaction_updater = Mock()
+        self.walletnotify_server = ZMQWalletNotifyHandler(transaction_updater, url="tcp://127.0.0.1:{}".format(port))
+        rescan = patch.object(self.walletnotify_server, "rescan")
+
+        try:
+            rescan.start()
+            self.walletnotify_server.start()
+
+            deadline = time.time() + 3
+            while not self.walletnotify_server.ready:
+                time.sleep(0.1)
+                self.assertLess(time.time(), deadline, "ZMQWalletNotifyHandler never become ready")
+
+            txhash = bytes(range(32))
+
+            # Subscription takes a moment to reach the publisher, keep publishing until the first message gets through
+            deadline = time.time() + 15
+            sequence = 0
+            while self.walletnotify_server.message_count == 0:
+                publisher.send_multipart([b"hashtx", txhash, struct.pack("<I", sequence)])
+                sequence += 1
+                time.sleep(0.1)
+                self.assertTrue(self.walletnotify_server.is_alive())
+                self.assertLess(time.time(), deadline, "ZMQWalletNotifyHandler did not get any messages")
+
+            # Handled by a worker thread
+            deadline = time.time() + 3
+            while not transaction_updater.handle_wallet_notify.called:
+                time.sleep(0.1)
+                self.assertLess(time.time(), deadline, "ZMQWalletNotifyHandler did not handle the transaction")
+
+            transaction_updater.handle_wallet_notify.assert_called_with("000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f")
+
+            # Catch up rescan on start up
+            self.walletnotify_server.rescan.assert_called_with()
+
+        finally:
+            self.walletnotify_server.stop()
+            self.walletnotify_server.join()
+            rescan.stop()
+            publisher.close()
+            context.term()
+
+    @unittest.skipIf(zmq is None, "pyzmq is not installed")
+    def test_zmq_walletnotify_sequence(self):
+        """Check that a gap in ZeroMQ sequence numbers requests a rescan."""
+
+        from ..backend.zmqwalletnotify import ZMQWalletNotifyHandler
+
+        handler = ZMQWalletNotifyHandler(None)
+
+        handler.check_sequence(struct.pack("<I", 0xffffffff))
+        handler.check_sequence(struct.pack("<I", 0))
+        handler.check_sequence(struct.pack("<I", 1))
+        self.assertFalse(handler.rescan_requested.is_set())
+
+        handler.check_sequence(struct.pack("<I", 3))
+        self.assertTrue(handler.rescan_requested.is_set())
+
+    @unittest.skipIf(zmq is None, "pyzmq is not installed")
+    def test_zmq_walletnotify_errors(self):
+        """Only non-wallet transaction errors are skipped silently."""
+
+        from ..backend.zmqwalletnotify import ZMQWalletNotifyHandler
+
+        def not_wallet_transaction(txid):
+            try:
+                raise JSONRPCException({"code": -5, "message": "Invalid or non-wallet transaction id"})
+            except JSONRPCException as e:
+                raise BitcoindJSONError("Error communicating with bitcoind API call gettransaction") from e
+
+        transaction_updater = Mock()
+        handler = ZMQWalletNotifyHandler(transaction_updater)
+
+        transaction_updater.handle_wallet_notify.side_effect = not_wallet_transaction
+        handler.handle_tx_update("faketransactionid")
+
+        transaction_updater.handle_wallet_notify.side_effect = BitcoindJSONError("Probably could not authenticate against bitcoind-like RPC, try manually with curl")
+        with self.assertRaises(BitcoindJSONError):
+            handler.handle_tx_update("faketransactionid")
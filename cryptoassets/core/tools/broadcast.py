@@ -15,7 +15,8 @@ Broadcaster is responsible for the following things
 
 import datetime
 import logging
-from collections import Counter
+
+from sqlalchemy.sql import func
 
 logger = logging.getLogger(__name__)
 
@@ -24,10 +25,29 @@ def _now():
     return datetime.datetime.utcnow()
 
 
+def get_broadcast_wallet_ids(session, wallet_class):
+    """Find wallets which have outgoing transactions waiting to be collected or sent.
+
+    :param wallet_class: Wallet model of a coin
+
+    :return: Set of wallet ids
+    """
+    Transaction = wallet_class.coin_description.Transaction
+    NetworkTransaction = wallet_class.coin_description.NetworkTransaction
+
+    pending = session.query(Transaction.wallet_id).filter(Transaction.state == "pending", Transaction.receiving_account_id == None, Transaction.network_transaction_id == None)  # noqa
+    ready = session.query(Transaction.wallet_id).join(NetworkTransaction, Transaction.network_transaction_id == NetworkTransaction.id).filter(NetworkTransaction.transaction_type == "broadcast", NetworkTransaction.opened_at == None, NetworkTransaction.closed_at == None)  # noqa
+
+    return set(wallet_id for wallet_id, in pending.union(ready))
+
+
 class Broadcaster:
     """Create and send transactions to the cryptoasset networks."""
 
-    def __init__(self, wallet, conflict_resolver, backend):
+    def __init__(self, wallet, conflict_resolver, backend, max_outputs=None):
+        """
+        :param max_outputs: How many outgoing transactions at most are merged to one broadcast. ``None`` puts all pending outgoing transactions of the wallet to one broadcast.
+        """
 
         assert wallet.id, "We can operate only on persisted wallets"
 
@@ -35,6 +55,7 @@ class Broadcaster:
         self.wallet_id = wallet.id
         self.conflict_resolver = conflict_resolver
         self.backend = backend
+        self.max_outputs = max_outputs
 
     def get_wallet(self, session):
         """Get a wallet instance within db transaction."""
@@ -62,31 +83,56 @@ class Broadcaster:
             wallet = self.get_wallet(session)
 
             # Get all outgoing pending transactions which are not yet part of any broadcast
-            NetworkTransaction = wallet.coin_description.NetworkTransaction
-
             txs = wallet.get_pending_outgoing_transactions()
 
             # TODO: If any priority / mixing rules, they should be applied here
-            if txs.count() > 0:
-                count = txs.count()
-                broadcast = NetworkTransaction()
-                broadcast.transaction_type = "broadcast"
-                broadcast.state = "pending"
-                broadcast.opened_at = None
-                broadcast.closed_at = None
-                session.add(broadcast)
-                session.flush()
+            if self.max_outputs:
+                return self._split_for_broadcast(session, txs)
+
+            count = txs.count()
+            if count > 0:
+                broadcast = self._create_broadcast(session)
                 txs.update({"network_transaction_id": broadcast.id})
 
                 logger.info("Collected %d outgoing transaction for broadcast %d", count, broadcast.id)
             else:
                 logger.debug("Did not find outgoing transactions for broadcast")
-                count = 0
 
             return count
 
         return build_broadcast()
 
+    def _create_broadcast(self, session):
+        NetworkTransaction = self.wallet_model.coin_description.NetworkTransaction
+        broadcast = NetworkTransaction()
+        broadcast.transaction_type = "broadcast"
+        broadcast.state = "pending"
+        broadcast.opened_at = None
+        broadcast.closed_at = None
+        session.add(broadcast)
+        session.flush()
+        return broadcast
+
+    def _split_for_broadcast(self, session, txs):
+        """Allocate pending outgoing transactions to broadcasts of at most ``max_outputs`` transactions, oldest first.
+
+        :return: Number of outgoing transactions collected
+        """
+        Transaction = self.wallet_model.coin_description.Transaction
+        tx_ids = [tx_id for tx_id, in txs.with_entities(Transaction.id).order_by(Transaction.id)]
+
+        if not tx_ids:
+            logger.debug("Did not find outgoing transactions for broadcast")
+            return 0
+
+        for i in range(0, len(tx_ids), self.max_outputs):
+            batch = tx_ids[i:i + self.max_outputs]
+            broadcast = self._create_broadcast(session)
+            session.query(Transaction).filter(Transaction.id.in_(batch)).update({"network_transaction_id": broadcast.id}, synchronize_session=False)
+            logger.info("Collected %d outgoing transaction for broadcast %d", len(batch), broadcast.id)
+
+        return len(tx_ids)
+
     def check_interrupted_broadcasts(self):
         """Check that there aren't any broadcasts which where opened, but never closed.
 
@@ -121,36 +167,45 @@ class Broadcaster:
 
             :yield: (address, amount) tuples how much to send to each address
             """
-            b = self.get_broadcast(session, broadcast_id)
-            assert b.opened_at is None
-            b.opened_at = _now()
-            session.add(b)
-
-            outputs = Counter()
-
-            for tx in b.transactions:
-                assert tx.state == "pending"
-                assert tx.receiving_account is None
-                assert tx.amount > 0
-                assert tx.address
-                assert tx.address.address
-                outputs[tx.address.address] += tx.amount
+            coin_description = self.wallet_model.coin_description
+            NetworkTransaction = coin_description.NetworkTransaction
+            Transaction = coin_description.Transaction
+            Address = coin_description.Address
+
+            # Open the broadcast with one conditional UPDATE, so that it cannot be opened twice
+            opened = session.query(NetworkTransaction).filter(NetworkTransaction.id == broadcast_id, NetworkTransaction.transaction_type == "broadcast", NetworkTransaction.opened_at == None).update(dict(opened_at=_now()), synchronize_session=False)  # noqa
+            assert opened == 1, "Broadcast {} was already opened".format(broadcast_id)
+
+            # Let the database sum the outputs per address instead of loading every transaction
+            amount = func.sum(Transaction.amount)
+            tx_count = func.count(Transaction.id)
+            sums = session.query(Address.address, amount, tx_count).join(Transaction.address).filter(Transaction.network_transaction_id == broadcast_id, Transaction.state == "pending", Transaction.receiving_account_id == None, Transaction.amount > 0).group_by(Address.address)  # noqa
+
+            outputs = {}
+            sendable_count = 0
+            for address, total, count in sums:
+                assert address
+                outputs[address] = total
+                sendable_count += count
+
+            # All transactions in the broadcast must be valid outgoing transactions
+            all_count = session.query(func.count(Transaction.id)).filter(Transaction.network_transaction_id == broadcast_id).scalar()
+            assert sendable_count == all_count, "Broadcast {} contains {} transactions which cannot be sent".format(broadcast_id, all_count - sendable_count)
 
             return outputs
 
         @self.conflict_resolver.managed_non_retryable_transaction
         def mark_sending_done(session, broadcast_id, txid):
-            b = self.get_broadcast(session, broadcast_id)
-            assert b.closed_at is None
-            b.txid = txid
-            b.closed_at = _now()
-            b.state = "broadcasted"
-            session.add(b)
-
-            # TODO: See if we can write update() more neatly
-            tx_ids = [tx.id for tx in b.transactions]
-            Transaction = b.coin_description.Transaction
-            session.query(Transaction).filter(Transaction.id.in_(tx_ids)).update(dict(state="broadcasted", processed_at=_now()), synchronize_session=False)
+            # Settle with two UPDATEs without loading the broadcast first
+            coin_description = self.wallet_model.coin_description
+            NetworkTransaction = coin_description.NetworkTransaction
+            Transaction = coin_description.Transaction
+            now = _now()
+
+            closed = session.query(NetworkTransaction).filter(NetworkTransaction.id == broadcast_id, NetworkTransaction.transaction_type == "broadcast", NetworkTransaction.closed_at == None).update(dict(txid=txid, closed_at=now, state="broadcasted"), synchronize_session=False)  # noqa
+            assert closed == 1, "Broadcast {} was not open".format(broadcast_id)
+
+            session.query(Transaction).filter(Transaction.network_transaction_id == broadcast_id).update(dict(state="broadcasted", processed_at=now), synchronize_session=False)
 
         @self.conflict_resolver.managed_transaction
         def charge_fees(session, broadcast_id, fee):
@@ -163,7 +218,7 @@ class Broadcaster:
         if count == 0:
             logger.debug("No broadcasts ready for sending to network")
         else:
-            logger.info("%d broadcasts prepared for sending", count)
+            logger.debug("%d broadcasts prepared for sending", count)
 
         broadcasted_count = 0
         total_fees = 0
@@ -12,26 +12,35 @@ More information about walletnotify behavior
 """
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from cryptoassets.core.models import GenericConfirmationTransaction
 
 
 logger = logging.getLogger(__name__)
 
+#: How many transactions we look up from the backend in one request
+BATCH_SIZE = 20
+
 
 def get_open_network_transactions(session, NetworkTransaction, confirmation_threshold):
     """Get list of transaction_type, txid of transactions we need to check."""
-    ntxs = session.query(NetworkTransaction).filter(NetworkTransaction.confirmations < confirmation_threshold, NetworkTransaction.txid != None)  # noqa
-    return [(ntx.transaction_type, ntx.txid) for ntx in ntxs]
+    # Only the columns are needed, don't build NetworkTransaction objects for them
+    ntxs = session.query(NetworkTransaction.transaction_type, NetworkTransaction.txid).filter(NetworkTransaction.confirmations < confirmation_threshold, NetworkTransaction.txid != None)  # noqa
+    return [(transaction_type, txid) for transaction_type, txid in ntxs]
 
 
-def update_confirmations(transaction_updater, confirmation_threshold):
+def update_confirmations(transaction_updater, confirmation_threshold, max_inflight=None):
     """Periodically rescan all open transactions for one particular cryptocurrency.
 
     We try to keep transaction  conflicts in minimum by not batching too many backend operations per each database session.
 
+    Transaction details are fetched from the backend in batches of :py:data:`BATCH_SIZE` transactions by up to ``max_inflight`` worker threads at a time. A single batch is fetched in the calling thread. Database updates are still written one by one in the calling thread, in the order of the open transactions.
+
     :param confirmation_treshold: Rescan the transaction if it has less confirmations than this
 
+    :param max_inflight: How many backend requests we have running at once. Defaults to the ``max_inflight`` option of the backend.
+
     :param transaction_updater: :py:class:`cryptoassets.core.backend.transactionupdater.TransactionUpdater` instance
 
     :return: Number of txupdate events fired
@@ -52,16 +61,39 @@ def update_confirmations(transaction_updater, confirmation_threshold):
     open_ntxs = get_open_ntxs()
 
     if len(open_ntxs) == 0:
-        return 0, 0
+        return 0
 
     logger.debug("Starting open transaction scan, coin:%s open network transactions: %d", coin.name, len(open_ntxs))
 
+    if not max_inflight:
+        max_inflight = backend.max_inflight
+
+    chunks = [open_ntxs[i:i + BATCH_SIZE] for i in range(0, len(open_ntxs), BATCH_SIZE)]
+
+    def fetch(chunk):
+        txids = [txid for transaction_type, txid in chunk]
+        assert all(txids)
+        transactions = backend.get_transactions(txids)
+        return [(transaction_type, txid, transactions.get(txid)) for transaction_type, txid in chunk]
+
+    def update(results):
+        txupdate_event_count = 0
+        for transaction_type, txid, txdata in results:
+            if txdata is None:
+                logger.warning("Backend did not give details for transaction %s, skipping", txid)
+                continue
+            logger.debug("Updating confirmations for %s type %s", txid, transaction_type)
+            _, txupdate_events = transaction_updater.update_network_transaction_confirmations(transaction_type, txid, txdata)
+            txupdate_event_count += len(txupdate_events)
+        return txupdate_event_count
+
+    if len(chunks) == 1 or max_inflight <= 1:
+        # Fetch in this thread, reusing its backend connection, instead of connecting from a new worker thread every run
+        return sum(update(fetch(chunk)) for chunk in chunks)
+
     total_txupdate_events = 0
-    for transaction_type, txid in open_ntxs:
-        assert txid
-        txdata = backend.get_transaction(txid)
-        logger.debug("Updating confirmations for %s type %s", txid, transaction_type)
-        _, txupdate_events = transaction_updater.update_network_transaction_confirmations(transaction_type, txid, txdata)
-        total_txupdate_events += len(txupdate_events)
-
-    return txupdate_events
+    with ThreadPoolExecutor(max_workers=min(max_inflight, len(chunks))) as executor:
+        for results in executor.map(fetch, chunks):
+            total_txupdate_events += update(results)
+
+    return total_txupdate_events
@@ -274,5 +274,5 @@ class Mock(MagicMock):
     def __getattr__(cls, name):
             return Mock()
 
-MOCK_MODULES = ['pytest', 'redis']
+MOCK_MODULES = ['pytest', 'redis', 'zmq']
 sys.modules.update((mod_name, Mock()) for mod_name in MOCK_MODULES)
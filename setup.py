@@ -20,6 +20,11 @@ requires = [
     'zope.dottedname'
     ]
 
+# Optional features, e.g. pip install cryptoassets.core[zmq]
+extras_require = {
+    'zmq': ['pyzmq'],
+    }
+
 setup(name='cryptoassets.core',
       version='0.3.dev0',
       description='A Python framework for building Bitcoin, other cryptocurrency (altcoin) and cryptoassets services',
@@ -44,6 +49,7 @@ setup(name='cryptoassets.core',
       zip_safe=False,
       test_suite='cryptoassets.core',
       install_requires=requires,
+      extras_require=extras_require,
       entry_points="""\
       [console_scripts]
       cryptoassets-initialize-database = cryptoassets.core.service.main:initializedb